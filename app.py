@@ -1,26 +1,75 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort, make_response, session
+from flask_migrate import Migrate
+import click
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from flask_login.config import EXEMPT_METHODS
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import is_resource_modified
 from models import db, Attraction, Photo, Review, User, AttractionCategory, WeatherSuitability
-from geopy.distance import geodesic
 import os
-import qrcode
-import uuid
-from datetime import datetime
-import photo_processor
-from geopy.distance import geodesic
+import functools
+import hashlib
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import blob_store
+import attraction_stats
+import query_plans
+import database
+import qr_codes
+import search
+import json_api
+from assets import Assets
+from image_queue import ImageQueue, QueueFull, PENDING, READY, FAILED
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload, load_only, aliased
+from ranking import RankingEngine, DEFAULT_LOCATION
+from spatial_index import SpatialIndex, bounding_box
+from pagination import encode_cursor, decode_cursor, NUMBER
+from cache import TaggedCache, VersionStamps
+from principal import Principal, ANONYMOUS
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key_here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///attraction.db'
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['ATTRACTIONS_PER_PAGE'] = 12
+app.config['MAX_ATTRACTIONS_PER_PAGE'] = 48
+app.config['LISTING_PHOTOS_PER_CARD'] = 5
+app.config['PHOTOS_PER_PAGE'] = 10
+app.config['IMAGE_QUEUE_WORKERS'] = 2
+app.config['IMAGE_QUEUE_MAX_DEPTH'] = 64
+app.config['IMAGE_QUEUE_MAX_ATTEMPTS'] = 3
+app.config['LISTING_CACHE_SIZE'] = 256
+app.config['LISTING_CACHE_TTL'] = 300
+# Decimal places user locations are rounded to for listing cache keys (3 is ~110m)
+app.config['LISTING_CACHE_LOCATION_PRECISION'] = 3
+app.config['SEARCH_MAX_RESULTS'] = 500
+# Distance at which a search match keeps half of its text relevance
+app.config['SEARCH_DISTANCE_SCALE_KM'] = 25
+# The spatial index is reloaded at least this often, to pick up coordinates changed by other processes
+app.config['SPATIAL_INDEX_MAX_AGE'] = 300
+# Seconds between checks of whether attractions were added or deleted by another process
+app.config['SPATIAL_INDEX_CHECK_INTERVAL'] = 10
+app.config['QR_CACHE_SIZE'] = 256
+app.config['QR_MAX_AGE'] = 24 * 60 * 60
+# Upper bound on how long another process can serve a page as unchanged after an edit
+app.config['PAGE_VERSION_MAX_AGE'] = 300
+app.config['USER_CACHE_SIZE'] = 1024
+app.config['USER_CACHE_TTL'] = 300
+# Longest time a permission check trusts the principal in the session without looking at the user again
+app.config['PRINCIPAL_MAX_AGE'] = 300
 
+# Database URL, pool sizing and SQLite pragmas, overridable from the environment
+database.configure(app)
 db.init_app(app)
+migrate = Migrate(app, db)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
+# Hashed, precompressed static files; run `flask build-assets` after changing static/
+assets = Assets(app)
 
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
@@ -32,54 +81,520 @@ def allowed_file(filename):
 
 
 with app.app_context():
+    database.tune(db.engine, app.config['SQLITE_PRAGMAS'])
     db.create_all()
+    search.ensure_index(db.engine)
+
+# Rendered /attractions pages, invalidated by tag when attractions or their photos change
+listing_cache = TaggedCache(app.config['LISTING_CACHE_SIZE'], app.config['LISTING_CACHE_TTL'])
+
+def listing_tag(category=None, weather=None):
+    """Cache tag of the listings filtered by category and weather (None for unfiltered)"""
+    return f"listing:{category or '*'}:{weather or '*'}"
+
+def attraction_tag(attraction_id):
+    """Cache tag of the listing pages that show an attraction's card"""
+    return f'attraction:{attraction_id}'
+
+# Version stamps of the whole catalogue and of each attraction, validating conditional GETs
+page_versions = VersionStamps(app.config['PAGE_VERSION_MAX_AGE'])
+CATALOGUE_VERSION = 'catalogue'
+
+def invalidate_listings(attraction):
+    """Drop the cached listings a new or changed attraction can appear in"""
+    category, weather = attraction.category.name, attraction.weather_suitability.name
+    listing_cache.invalidate(
+        listing_tag(), listing_tag(category), listing_tag(weather=weather), listing_tag(category, weather)
+    )
+    page_versions.bump(CATALOGUE_VERSION, attraction_tag(attraction.id))
+
+def invalidate_attraction_cards(*attraction_ids):
+    """Drop the cached listing pages showing these attractions, e.g. after their photos change"""
+    tags = [attraction_tag(attraction_id) for attraction_id in attraction_ids]
+    listing_cache.invalidate(*tags)
+    page_versions.bump(CATALOGUE_VERSION, *tags)
+
+def page_validators(*versions):
+    """
+    ETag and Last-Modified of a page built from the given version stamps, as seen by the current visitor.
+
+    Only the session and in-memory stamps are read, never the database.
+
+    Returns:
+        Tuple of (etag, last_modified), or None if the page must not be
+        validated: flashed messages are waiting to be shown, or the visitor
+        is about to be logged in from a remember-me cookie
+    """
+    if '_flashes' in session:
+        return None
+    user_id = session.get('_user_id')
+    if user_id is None and app.config.get('REMEMBER_COOKIE_NAME', 'remember_token') in request.cookies:
+        return None
+
+    stamps = [page_versions.get(version) for version in versions]
+    key = f"{request.endpoint}:{user_id}:{':'.join(map(repr, stamps))}"
+    etag = hashlib.sha256(key.encode('utf-8')).hexdigest()[:20]
+    return etag, datetime.fromtimestamp(max(stamps), timezone.utc)
+
+def not_modified(validators):
+    """A 304 response if the client's copy is still current, otherwise None"""
+    if validators is None or request.method not in ('GET', 'HEAD'):
+        return None
+    etag, last_modified = validators
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return with_validators(make_response('', 304), validators)
+
+def with_validators(response, validators):
+    """Add validators to a page response so the browser revalidates it on every visit"""
+    response = make_response(response)
+    if validators is not None:
+        etag, last_modified = validators
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+    return response
+
+# Rendered QR codes, in memory and under UPLOAD_FOLDER/qr
+qr_cache = qr_codes.QRCodeCache(os.path.join(app.config['UPLOAD_FOLDER'], qr_codes.CACHE_FOLDER),
+                                app.config['QR_CACHE_SIZE'])
+
+# Background processing of uploaded photos
+photo_queue = ImageQueue(app, on_ready=invalidate_attraction_cards)
+
+# In-memory grid index over attraction coordinates, built on first use
+attraction_index = SpatialIndex()
+# time.monotonic() of the last attraction_index_version() check
+attraction_index_checked = 0.0
+
+# Snapshots of logged-in users, so Flask-Login doesn't query the user table on every request
+user_cache = TaggedCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+# Version stamps of users; session principals issued before a user's stamp are stale
+user_versions = VersionStamps(app.config['PRINCIPAL_MAX_AGE'])
+
+def user_tag(user_id):
+    """Cache tag and version stamp key of a user"""
+    return f'user:{user_id}'
+
+def invalidate_user(user_id):
+    """Forget a user's cached snapshot and session principals, e.g. after a profile or admin change"""
+    user_cache.invalidate(user_tag(user_id))
+    user_versions.bump(user_tag(user_id))
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def user_changed(mapper, connection, user):
+    invalidate_user(user.id)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-def generate_unique_filename(filename):
-    """Generate a unique filename to prevent overwriting"""
-    ext = os.path.splitext(filename)[1]
-    unique_filename = str(uuid.uuid4()) + ext
-    return unique_filename
-
-def generate_attraction_qr(attraction):
-    """Generate QR code for an attraction"""
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(f"Attraction: {attraction.name}\nDescription: {attraction.description}")
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    filename = f"qr_{attraction.id}.png"
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    img.save(filepath)
-    return filename
-
-def rank_attractions(attractions, user_location=None):
-    user_location = 29.616395, -81.202324
+    """Load the logged-in user as a Principal, from user_cache when possible"""
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return None
+    principal = user_cache.get(user_tag(user_id))
+    if principal is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        principal = cache_user(user)
+    return principal
+
+def cache_user(user):
+    """Store a snapshot of a user in user_cache and return it"""
+    principal = Principal.from_user(user)
+    user_cache.set(user_tag(user.id), principal, tags=[user_tag(user.id)])
+    return principal
+
+def remember_principal(principal):
+    """Embed a principal in the session for current_principal()"""
+    session['principal'] = principal.to_session(user_versions.get(user_tag(principal.id)))
+
+@app.template_global()
+def current_principal():
+    """
+    The visitor's user id and admin flag, without a query on most requests.
+
+    Read from the principal embedded in the session. When it is missing or
+    stale, the user is loaded through load_user and embedded again.
+
+    Returns:
+        Principal, ANONYMOUS if nobody is logged in
+    """
+    user_id = session.get('_user_id')
+    if user_id is not None:
+        principal = Principal.from_session(session.get('principal'), user_versions.get(user_tag(user_id)))
+        if principal is not None and str(principal.id) == user_id:
+            return principal
+    # Also covers logging in from a remember-me cookie
+    if not current_user.is_authenticated:
+        return ANONYMOUS
+    remember_principal(current_user)
+    return current_user._get_current_object()
+
+def principal_required(view):
+    """Like login_required, but checks the session principal instead of loading the user"""
+    @functools.wraps(view)
+    def decorated_view(*args, **kwargs):
+        if request.method in EXEMPT_METHODS or app.config.get('LOGIN_DISABLED'):
+            return view(*args, **kwargs)
+        if not current_principal().is_authenticated:
+            return login_manager.unauthorized()
+        return view(*args, **kwargs)
+    return decorated_view
+
+def generate_attraction_qr(attraction, fmt='png'):
+    """Return the QR code file of an attraction relative to UPLOAD_FOLDER, rendering it only if needed"""
+    payload = qr_codes.attraction_payload(attraction.name, attraction.description)
+    path = qr_cache.path(attraction.id, payload, fmt)
+    return os.path.relpath(path, app.config['UPLOAD_FOLDER'])
+
+def index_tags(attraction):
+    """Filterable attributes stored alongside each point in the spatial index"""
+    return {
+        'category': attraction.category.name,
+        'weather': attraction.weather_suitability.name
+    }
+
+def attraction_index_version():
+    """Cheap stamp of the attraction table that changes when rows are added or deleted"""
+    return tuple(db.session.query(db.func.max(Attraction.id), db.func.count(Attraction.id)).one())
+
+def get_attraction_index():
+    """
+    Return the attraction spatial index, loading it from the database when stale.
+
+    Attractions added here are indexed as they are created. Changes made by
+    other workers and scripts (import_attractions.py, geo_code_latlong.py)
+    are picked up by reloading when the index is older than
+    SPATIAL_INDEX_MAX_AGE, or when attraction_index_version() differs from
+    the one it was built from. The version is checked at most once per
+    SPATIAL_INDEX_CHECK_INTERVAL seconds.
+    """
+    global attraction_index_checked
+    now = time.monotonic()
+    if attraction_index.built and now - attraction_index.built_at < app.config['SPATIAL_INDEX_MAX_AGE']:
+        if now - attraction_index_checked < app.config['SPATIAL_INDEX_CHECK_INTERVAL']:
+            return attraction_index
+        attraction_index_checked = now
+        version = attraction_index_version()
+        if version == attraction_index.version:
+            return attraction_index
+    else:
+        version = attraction_index_version()
+
+    rows = db.session.query(
+        Attraction.id,
+        Attraction.latitude,
+        Attraction.longitude,
+        Attraction.category,
+        Attraction.weather_suitability
+    )
+    attraction_index.rebuild(
+        ((row.id, row.latitude, row.longitude, index_tags(row)) for row in rows),
+        version
+    )
+    attraction_index_checked = now
+    return attraction_index
+
+def get_user_location():
+    """
+    Read the user's location from the `near` ("lat,lon") or `lat`/`lon` query parameters.
+
+    Returns:
+        Tuple of (latitude, longitude), defaults to Palm Coast center
+    """
+    try:
+        if 'near' in request.args:
+            latitude, longitude = (float(part) for part in request.args['near'].split(','))
+        else:
+            latitude = float(request.args['lat'])
+            longitude = float(request.args['lon'])
+    except (KeyError, ValueError):
+        return DEFAULT_LOCATION
+
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return DEFAULT_LOCATION
+    return latitude, longitude
+
+def quantize_location(location):
+    """Round a location to LISTING_CACHE_LOCATION_PRECISION so nearby users share cached listings"""
+    precision = app.config['LISTING_CACHE_LOCATION_PRECISION']
+    return round(location[0], precision), round(location[1], precision)
+
+def bounding_box_filter(user_location, radius_km):
+    """
+    SQL conditions restricting attractions to the lat/lon box around a search circle.
+
+    The box is a superset of the circle, so the exact distance cut still has
+    to happen in rank_attractions. It lets the database use the
+    (latitude, longitude) index instead of returning every row.
+
+    Returns:
+        List of conditions on Attraction columns
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(user_location, radius_km)
+    conditions = [Attraction.latitude.between(min_lat, max_lat)]
+    if min_lon <= max_lon:
+        if min_lon > -180 or max_lon < 180:
+            conditions.append(Attraction.longitude.between(min_lon, max_lon))
+    else:
+        # Box crosses the antimeridian
+        conditions.append(db.or_(Attraction.longitude >= min_lon, Attraction.longitude <= max_lon))
+    return conditions
+
+def rank_attractions(attractions, user_location=None, limit=None, exact=False, radius_km=None):
     """
     Rank attractions based purely on distance from user location.
     
     Args:
         attractions: List of attraction objects
         user_location: Tuple of (latitude, longitude), defaults to Palm Coast center
+        limit: Only return the closest `limit` attractions
+        exact: Re-rank the returned attractions by exact geodesic distance
+        radius_km: Drop attractions farther than this many kilometers
     
     Returns:
         Sorted list of attractions from closest to farthest
     """
-    def calculate_distance(attraction):
-        """
-        Calculate distance between user location and attraction location.
-        
-        Args:
-            attraction: Attraction object
-        
-        Returns:
-            Distance in kilometers
-        """
-        return geodesic(user_location, (attraction.latitude, attraction.longitude)).kilometers
+    if user_location is None:
+        user_location = DEFAULT_LOCATION
+
+    engine = RankingEngine.from_attractions(attractions)
+    ranked = engine.rank(user_location, limit=limit, exact=exact, radius_km=radius_km)
+    return [attraction for attraction, _ in ranked]
+
+def submit_blobs(blobs, target_size):
+    """
+    Hand newly stored blobs to the background image queue as one batch.
+
+    Args:
+        blobs: Committed pending Blobs returned by blob_store.attach
+        target_size: Tuple of (width, height) of the full-size rendition
+
+    If the queue is full the blobs and their photos are marked as failed instead.
+    """
+    # Uploads of the same bytes share a blob
+    blobs = list({blob.id: blob for blob in blobs}.values())
+    if not blobs:
+        return
+    try:
+        photo_queue.submit_batch([(blob.id, blob.filename) for blob in blobs], target_size=target_size)
+    except QueueFull:
+        for blob in blobs:
+            blob.status = FAILED
+            blob.processing_error = 'Image processing queue is full'
+            for photo in blob.photos:
+                if photo.status == PENDING:
+                    photo.status = FAILED
+                    photo.processing_error = blob.processing_error
+        db.session.commit()
+        app.logger.error(f'Image queue full, blobs {[blob.id for blob in blobs]} not processed')
+
+def card_photos(attraction_ids, per_card):
+    """
+    The first ready photos of several attractions, in one query.
+
+    ROW_NUMBER() caps the rows per attraction in the database, so an
+    attraction with thousands of photos costs no more than one with a few.
+
+    Args:
+        attraction_ids: Attractions on the page
+        per_card: Photos per attraction, e.g. LISTING_PHOTOS_PER_CARD
+
+    Returns:
+        Dict of attraction id -> list of Photos ordered by id
+    """
+    if not attraction_ids:
+        return {}
+    ranked = db.select(
+        Photo.id,
+        db.func.row_number().over(partition_by=Photo.attraction_id, order_by=Photo.id).label('position')
+    ).where(Photo.attraction_id.in_(attraction_ids), Photo.status == READY).subquery()
+    photos = (
+        Photo.query.join(ranked, ranked.c.id == Photo.id)
+        .filter(ranked.c.position <= per_card)
+        .order_by(Photo.attraction_id, Photo.id)
+    )
+    by_attraction = {}
+    for photo in photos:
+        by_attraction.setdefault(photo.attraction_id, []).append(photo)
+    return by_attraction
+
+def photo_feed_page(attraction_id, cursor=None, per_page=None, options=None):
+    """
+    One page of an attraction's photos, most recent first.
+
+    Pages are keyed on (upload_date, id) rather than OFFSET, so later pages
+    cost the same as the first.
+
+    Args:
+        attraction_id: Attraction whose photos to list
+        cursor: Token returned with the previous page
+        per_page: Photos per page, defaults to PHOTOS_PER_PAGE
+        options: Loader options for the query, defaults to loading each
+            photo's owner in the same query
+
+    Returns:
+        Tuple of (photos, next_cursor); next_cursor is None on the last page
+
+    Raises:
+        ValueError if the cursor is malformed
+    """
+    per_page = per_page or app.config['PHOTOS_PER_PAGE']
+    query = Photo.query.options(*(options or [joinedload(Photo.owner)])).filter(
+        Photo.attraction_id == attraction_id,
+        Photo.status == READY
+    )
+
+    if cursor:
+        upload_date, photo_id = decode_cursor(cursor, 2, (str, int))
+        upload_date = datetime.fromisoformat(upload_date)
+        query = query.filter(db.or_(
+            Photo.upload_date < upload_date,
+            db.and_(Photo.upload_date == upload_date, Photo.id < photo_id)
+        ))
+
+    photos = query.order_by(Photo.upload_date.desc(), Photo.id.desc()).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(photos) > per_page:
+        photos = photos[:per_page]
+        last = photos[-1]
+        next_cursor = encode_cursor(last.upload_date.isoformat(), last.id)
+    return photos, next_cursor
+
+@app.template_global()
+def photo_url(photo, rendition='full', fmt='jpeg'):
+    """URL of one rendition of a photo, falling back to the original upload"""
+    entry = (photo.renditions or {}).get(rendition) or (photo.renditions or {}).get('full')
+    filename = entry[fmt] if entry and fmt in entry else photo.filename
+    return url_for('static', filename='uploads/' + filename)
+
+@app.template_global()
+def photo_srcset(photo, fmt='jpeg'):
+    """srcset value listing every rendition of a photo in the given format"""
+    entries = sorted((photo.renditions or {}).values(), key=lambda entry: entry['width'])
+    return ', '.join(
+        f"{url_for('static', filename='uploads/' + entry[fmt])} {entry['width']}w"
+        for entry in entries if fmt in entry
+    )
 
-    return sorted(attractions, key=calculate_distance)
+def serialize_photo(photo):
+    """JSON representation of a photo post for the photo feed"""
+    return {
+        'id': photo.id,
+        'url': photo_url(photo),
+        'srcset': photo_srcset(photo),
+        'webp_srcset': photo_srcset(photo, 'webp'),
+        'caption': photo.caption,
+        'rating': photo.rating,
+        'username': photo.owner.username if photo.owner else None,
+        'upload_date': photo.upload_date.isoformat() if photo.upload_date else None,
+        'delete_url': url_for('delete_photo', photo_id=photo.id),
+        'can_delete': photo.user_id == 1234 or current_principal().is_admin
+    }
+
+def listing_params():
+    """
+    Parse the listing query parameters shared by list_attractions and the JSON API.
+
+    Returns:
+        Dict of search_query, category, weather, user_location (rounded
+        with quantize_location), radius, limit, exact, per_page and cursor
+    """
+    per_page = request.args.get('per_page', app.config['ATTRACTIONS_PER_PAGE'], type=int)
+    return {
+        'search_query': request.args.get('q', '').strip(),
+        'category': request.args.get('category'),
+        'weather': request.args.get('weather'),
+        'user_location': quantize_location(get_user_location()),
+        'radius': request.args.get('radius', type=float),
+        'limit': request.args.get('limit', type=int),
+        'exact': request.args.get('exact') == '1',
+        'per_page': max(1, min(per_page, app.config['MAX_ATTRACTIONS_PER_PAGE'])),
+        'cursor': request.args.get('cursor'),
+    }
+
+def listing_page(params):
+    """
+    Find one page of attractions for parsed listing parameters.
+
+    Args:
+        params: Dict from listing_params()
+
+    Returns:
+        Tuple of (hits, next_cursor). hits are (attraction id, distance_km)
+        pairs, or (attraction id, score) when searching, in page order;
+        next_cursor is None on the last page. The `exact` re-ranking within
+        the page is left to the caller, which has the rows loaded.
+
+    Listings without a text search are answered from the spatial index, so
+    only the neighbourhood of the user (or of the previous page) is looked
+    at; searches rank just their full-text matches.
+
+    Raises:
+        ValueError if the cursor is malformed
+    """
+    search_query, category, weather = params['search_query'], params['category'], params['weather']
+    user_location, radius, limit = params['user_location'], params['radius'], params['limit']
+    per_page = params['per_page']
+    # (distance, id), or (score, id) for searches
+    after = decode_cursor(params['cursor'], 2, (NUMBER, int)) if params['cursor'] else None
+
+    filters = []
+    if category:
+        filters.append(Attraction.category == category)
+    if weather:
+        filters.append(Attraction.weather_suitability == weather)
+    if radius is not None:
+        # Let the database narrow search matches down to the search box first
+        filters.extend(bounding_box_filter(user_location, radius))
+
+    def matches(tags):
+        return ((not category or tags['category'] == category) and
+                (not weather or tags['weather'] == weather))
+
+    if search_query:
+        # Filtered before the limit, so matches outside the filters don't use up the results
+        relevance = search.search(search_query, limit=app.config['SEARCH_MAX_RESULTS'], filters=filters)
+        # Rank on (id, latitude, longitude) of the matches only; full rows are loaded for one page
+        query = Attraction.query.filter(*filters, Attraction.id.in_(list(relevance)))
+        engine = RankingEngine.from_rows(query.with_entities(Attraction.id, Attraction.latitude, Attraction.longitude))
+        hits = search.blend(engine.rank(user_location, radius_km=radius), relevance,
+                            app.config['SEARCH_DISTANCE_SCALE_KM'])
+        if limit is not None:
+            hits = hits[:limit]
+        if after is not None:
+            # The cursor is (score, id), best score first
+            hits = [hit for hit in hits if (-hit[1], hit[0]) > (-after[0], after[1])]
+        hits = hits[:per_page + 1]
+    elif limit is None and radius is None:
+        # Answer from the spatial index without touching the table; only the
+        # neighbourhood of the previous page is searched
+        hits = get_attraction_index().nearest(user_location, per_page + 1, predicate=matches, after=after)
+    else:
+        if radius is None:
+            hits = get_attraction_index().nearest(user_location, limit, predicate=matches)
+        else:
+            hits = get_attraction_index().within(user_location, radius, predicate=matches)
+            hits.sort(key=lambda hit: (hit[1], hit[0]))
+            if limit is not None:
+                hits = hits[:limit]
+        if after is not None:
+            hits = [hit for hit in hits if (hit[1], hit[0]) > after]
+        hits = hits[:per_page + 1]
+
+    next_cursor = None
+    if len(hits) > per_page:
+        hits = hits[:per_page]
+        # (distance, id), or (score, id) for searches
+        last_id, last_value = hits[-1]
+        next_cursor = encode_cursor(last_value, last_id)
+    return hits, next_cursor
 
 @app.route('/')
 def index():
@@ -89,21 +604,87 @@ def index():
 
 @app.route('/attractions')
 def list_attractions():
-    """List attractions with optional filtering"""
-    category = request.args.get('category')
-    weather = request.args.get('weather')
-    
-    query = Attraction.query
-    if category:
-        query = query.filter(Attraction.category == category)
-    if weather:
-        query = query.filter(Attraction.weather_suitability == weather)
-    
-    attractions = rank_attractions(query.all())
-    return render_template('attractions.html', attractions=attractions)
+    """
+    List attractions with optional filtering, one page at a time
+
+    Query parameters:
+        q: Full-text search over names and descriptions; matches are
+           ordered by relevance blended with distance
+        category, weather: Filter by enum name
+        near: "lat,lon" of the user (or `lat` and `lon` separately)
+        radius: Only attractions within this many kilometers
+        limit: Only the closest `limit` attractions
+        exact: "1" to order each page by exact geodesic distance
+        per_page: Attractions per page
+        cursor: Token for the next page, from the previous page's link
+
+    Rendered pages are cached per filter set and rounded user location,
+    and revalidated against the catalogue version before anything else.
+    """
+    validators = page_validators(CATALOGUE_VERSION)
+    cached_response = not_modified(validators)
+    if cached_response is not None:
+        return cached_response
+
+    params = listing_params()
+    search_query, user_location = params['search_query'], params['user_location']
+
+    cache_key = tuple(params.values())
+    cached = listing_cache.get(cache_key)
+    if cached is not None:
+        return with_validators(cached, validators)
+
+    try:
+        hits, next_cursor = listing_page(params)
+    except ValueError:
+        abort(400)
+
+    ids = [attraction_id for attraction_id, _ in hits]
+    by_id = {}
+    if ids:
+        by_id = {a.id: a for a in Attraction.query.filter(Attraction.id.in_(ids))}
+    attractions = [by_id[i] for i in ids if i in by_id]
+    if params['exact'] and not search_query:
+        attractions = rank_attractions(attractions, user_location=user_location, exact=True)
+
+    next_url = None
+    if next_cursor:
+        next_args = request.args.to_dict()
+        # The page is shared by everyone near this location, so link with the rounded one
+        next_args.pop('lat', None)
+        next_args.pop('lon', None)
+        next_args['near'] = f'{user_location[0]},{user_location[1]}'
+        next_args['cursor'] = next_cursor
+        next_url = url_for('list_attractions', **next_args)
+
+    # Carried over by the search form. The page is shared by everyone with the same
+    # cache key, so only values from the key, with the rounded location
+    search_args = {'category': params['category'], 'weather': params['weather'], 'radius': params['radius']}
+    if any(name in request.args for name in ('near', 'lat', 'lon')):
+        search_args['near'] = f'{user_location[0]},{user_location[1]}'
+
+    html = render_template(
+        'attractions.html',
+        attractions=attractions,
+        next_url=next_url,
+        search_args=search_args,
+        # Every card's photos in one extra query instead of one per card
+        card_photos=card_photos(ids, app.config['LISTING_PHOTOS_PER_CARD']),
+        search_query=search_query
+    )
+    # Any new matching attraction can reshuffle the pages; photo changes only affect the cards shown
+    tags = [listing_tag(params['category'], params['weather'])] + [attraction_tag(attraction_id) for attraction_id in ids]
+    listing_cache.set(cache_key, html, tags=tags)
+    return with_validators(html, validators)
 
 @app.route('/attraction/<int:attraction_id>', methods=['GET', 'POST'])
 def attraction_detail(attraction_id):
+    # Validators are taken before the page is built, so a change made meanwhile gives a new version
+    validators = page_validators(attraction_tag(attraction_id))
+    cached_response = not_modified(validators)
+    if cached_response is not None:
+        return cached_response
+
     attraction = Attraction.query.get_or_404(attraction_id)
     
     if request.method == 'POST':
@@ -113,37 +694,41 @@ def attraction_detail(attraction_id):
                 photo = request.files['photo']
                 
                 if photo and allowed_file(photo.filename):
+                    if photo_queue.full():
+                        flash('We are processing a lot of photos right now. Please try again shortly.', 'error')
+                        return redirect(url_for('attraction_detail', attraction_id=attraction_id))
+
                     try:
-                        # Process and save the image
-                        filename = photo_processor.process_and_save_image(
-                            photo, 
-                            app.config['UPLOAD_FOLDER'], 
-                            target_size=(1200, 800)
-                        )
-                        
                         # Create new photo record
                         new_photo = Photo(
-                            filename=filename,
                             caption=request.form['caption'],
                             rating=int(request.form['rating']),
                             attraction_id=attraction_id,
                             user_id=1234,
                             upload_date=datetime.utcnow()
                         )
+
+                        # Store the upload by content and add the photo; renditions are produced in the background
+                        blob = blob_store.attach(new_photo, photo, app.config['UPLOAD_FOLDER'], target_size=(1200, 800))
                         
-                        # Update attraction's average rating
-                        new_rating = int(request.form['rating'])
-                        attraction.total_visits += 1
-                        attraction.average_rating = (
-                            (attraction.average_rating * (attraction.total_visits - 1) + new_rating) / 
-                            attraction.total_visits
-                        )
-                        
-                        db.session.add(new_photo)
-                        db.session.add(attraction)
+                        # Record the rated visit and update the attraction's aggregates in place
+                        db.session.add(Review(
+                            rating=new_photo.rating,
+                            comment=new_photo.caption,
+                            attraction_id=attraction_id,
+                            user_id=1234,
+                            visit_date=new_photo.upload_date
+                        ))
+                        attraction_stats.record_visit(attraction_id, new_photo.rating)
                         db.session.commit()
-                        
-                        flash('Photo posted successfully!', 'success')
+                        invalidate_attraction_cards(attraction_id)
+
+                        submit_blobs([blob] if blob else [], target_size=(1200, 800))
+                        if new_photo.status == READY:
+                            flash('Photo posted successfully!', 'success')
+                            return redirect(url_for('attraction_detail', attraction_id=attraction_id))
+                        flash('Photo posted successfully! It will appear once processing finishes.', 'success')
+                        return redirect(url_for('attraction_detail', attraction_id=attraction_id, pending=[new_photo.id]))
                     except Exception as e:
                         db.session.rollback()
                         flash(f'Error uploading photo: {str(e)}', 'error')
@@ -155,10 +740,229 @@ def attraction_detail(attraction_id):
             flash('An unexpected error occurred.', 'error')
             app.logger.error(f"Unexpected error in attraction_detail: {str(e)}")
     
-    # Fetch photos sorted by upload date, most recent first
-    photos = Photo.query.filter_by(attraction_id=attraction_id).order_by(Photo.upload_date.desc()).all()
+    # Render the first page of photos; the rest is loaded from the photo feed on scroll
+    photos, next_cursor = photo_feed_page(attraction_id)
+    next_url = None
+    if next_cursor:
+        next_url = url_for('attraction_photos', attraction_id=attraction_id, cursor=next_cursor)
     
-    return render_template('attraction_detail.html', attraction=attraction, photos=photos)
+    return with_validators(render_template(
+        'attraction_detail.html',
+        attraction=attraction,
+        photos=photos,
+        next_url=next_url,
+        pending_photo_ids=request.args.getlist('pending', type=int)
+    ), validators)
+
+@app.route('/attraction/<int:attraction_id>/qr')
+def attraction_qr(attraction_id):
+    """
+    QR code of an attraction as PNG (default) or SVG (`?format=svg`).
+
+    The ETag is a hash of what the code encodes, so revalidation never
+    renders anything, and the image itself comes from qr_cache.
+    """
+    fmt = request.args.get('format', 'png')
+    if fmt not in qr_codes.FORMATS:
+        abort(400)
+
+    row = db.session.query(Attraction.name, Attraction.description).filter(Attraction.id == attraction_id).first()
+    if row is None:
+        abort(404)
+    payload = qr_codes.attraction_payload(row.name, row.description)
+    etag = qr_codes.content_hash(payload, fmt)
+
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = make_response(qr_cache.get(attraction_id, payload, fmt))
+        response.mimetype = qr_codes.FORMATS[fmt]
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['QR_MAX_AGE']
+    return response
+
+@app.route('/photo/<int:photo_id>/status')
+def photo_status(photo_id):
+    """Processing status of an uploaded photo, polled while it is pending"""
+    photo = Photo.query.get_or_404(photo_id)
+    return jsonify({
+        'id': photo.id,
+        'status': photo.status,
+        'error': photo.processing_error,
+        'photo': serialize_photo(photo) if photo.status == READY else None
+    })
+
+@app.route('/attraction/<int:attraction_id>/photos')
+def attraction_photos(attraction_id):
+    """Paginated JSON feed of an attraction's photos, most recent first"""
+    per_page = request.args.get('per_page', app.config['PHOTOS_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, 100))
+
+    try:
+        photos, next_cursor = photo_feed_page(attraction_id, request.args.get('cursor'), per_page)
+    except ValueError:
+        abort(400)
+
+    next_url = None
+    if next_cursor:
+        next_url = url_for('attraction_photos', attraction_id=attraction_id, cursor=next_cursor, per_page=per_page)
+
+    return jsonify({
+        'photos': [serialize_photo(photo) for photo in photos],
+        'next_cursor': next_cursor,
+        'next_url': next_url
+    })
+
+# Versioned JSON API for mobile clients, mirroring the listing and detail pages
+api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+# Columns of the attraction detail and its photos sent by the API; nothing else is loaded
+API_PHOTO_OPTIONS = [
+    load_only(Photo.id, Photo.filename, Photo.renditions, Photo.caption, Photo.rating, Photo.upload_date,
+              Photo.user_id, raiseload=True),
+    joinedload(Photo.owner).load_only(User.username, raiseload=True),
+]
+API_SUMMARY_LENGTH = 120
+
+def api_photo(photo):
+    """Compact JSON representation of a photo; photo needs id, filename and renditions"""
+    return {
+        'id': photo.id,
+        'url': photo_url(photo),
+        'srcset': photo_srcset(photo),
+        'webp_srcset': photo_srcset(photo, 'webp'),
+    }
+
+@api_v1.errorhandler(HTTPException)
+def api_error(e):
+    return json_api.json_response({'error': e.name, 'message': e.description}, e.code)
+
+@api_v1.route('/attractions')
+def api_list_attractions():
+    """
+    One page of attractions as JSON.
+
+    Takes the same query parameters as list_attractions and orders the
+    attractions the same way; ties are broken by id, so pages are stable.
+    Only the columns in the payload are selected, with the description cut
+    to API_SUMMARY_LENGTH characters by the database.
+    """
+    validators = page_validators(CATALOGUE_VERSION)
+    cached_response = not_modified(validators)
+    if cached_response is not None:
+        return cached_response
+
+    params = listing_params()
+    cache_key = ('api',) + tuple(params.values())
+    data = listing_cache.get(cache_key)
+    if data is None:
+        try:
+            hits, next_cursor = listing_page(params)
+        except ValueError:
+            abort(400, 'Malformed cursor')
+
+        ids = [attraction_id for attraction_id, _ in hits]
+        cover = aliased(Photo)
+        rows = db.session.execute(
+            db.select(
+                Attraction.id, Attraction.name,
+                db.func.substr(Attraction.description, 1, API_SUMMARY_LENGTH).label('summary'),
+                Attraction.latitude, Attraction.longitude, Attraction.category, Attraction.weather_suitability,
+                Attraction.average_rating, Attraction.total_visits, cover.id.label('photo_id'),
+                cover.filename, cover.renditions
+            )
+            .outerjoin(cover, db.and_(cover.id == Attraction.cover_photo_id, cover.status == READY))
+            .where(Attraction.id.in_(ids))
+        ).all() if ids else []
+        by_id = {row.id: row for row in rows}
+        rows = [by_id[i] for i in ids if i in by_id]
+        if params['exact'] and not params['search_query']:
+            rows = rank_attractions(rows, user_location=params['user_location'], exact=True)
+        distances = RankingEngine.from_attractions(rows).distances(params['user_location']) if rows else []
+        scores = dict(hits) if params['search_query'] else {}
+
+        next_url = None
+        if next_cursor:
+            next_args = request.args.to_dict()
+            next_args.pop('lat', None)
+            next_args.pop('lon', None)
+            next_args['near'] = f"{params['user_location'][0]},{params['user_location'][1]}"
+            next_args['cursor'] = next_cursor
+            next_url = url_for('api_v1.api_list_attractions', **next_args)
+
+        data = {
+            'attractions': [
+                {
+                    'id': row.id,
+                    'name': row.name,
+                    'summary': row.summary,
+                    'category': row.category.name,
+                    'weather': row.weather_suitability.name,
+                    'latitude': row.latitude,
+                    'longitude': row.longitude,
+                    'average_rating': row.average_rating,
+                    'total_visits': row.total_visits,
+                    'distance_km': float(distance),
+                    'score': scores.get(row.id),
+                    'photo': api_photo(SimpleNamespace(
+                        id=row.photo_id, filename=row.filename, renditions=row.renditions
+                    )) if row.photo_id else None,
+                }
+                for row, distance in zip(rows, distances)
+            ],
+            'next_cursor': next_cursor,
+            'next_url': next_url,
+        }
+        tags = [listing_tag(params['category'], params['weather'])] + [attraction_tag(i) for i in ids]
+        listing_cache.set(cache_key, data, tags=tags)
+    return with_validators(json_api.json_response(data), validators)
+
+@api_v1.route('/attractions/<int:attraction_id>')
+def api_attraction_detail(attraction_id):
+    """
+    An attraction and the first page of its photos as JSON.
+
+    Later photo pages come from next_url, the same feed as the detail page.
+    """
+    validators = page_validators(attraction_tag(attraction_id))
+    cached_response = not_modified(validators)
+    if cached_response is not None:
+        return cached_response
+
+    attraction = db.session.get(Attraction, attraction_id, options=[
+        load_only(Attraction.id, Attraction.name, Attraction.description, Attraction.latitude,
+                  Attraction.longitude, Attraction.category, Attraction.weather_suitability,
+                  Attraction.average_rating, Attraction.total_visits, raiseload=True)
+    ])
+    if attraction is None:
+        abort(404)
+
+    photos, next_cursor = photo_feed_page(attraction_id, options=API_PHOTO_OPTIONS)
+    next_url = None
+    if next_cursor:
+        next_url = url_for('attraction_photos', attraction_id=attraction_id, cursor=next_cursor)
+
+    return with_validators(json_api.json_response({
+        'id': attraction.id,
+        'name': attraction.name,
+        'description': attraction.description,
+        'category': attraction.category.name,
+        'weather': attraction.weather_suitability.name,
+        'latitude': attraction.latitude,
+        'longitude': attraction.longitude,
+        'average_rating': attraction.average_rating,
+        'total_visits': attraction.total_visits,
+        'photos': [
+            dict(api_photo(photo), caption=photo.caption, rating=photo.rating,
+                 username=photo.owner.username if photo.owner else None, upload_date=photo.upload_date)
+            for photo in photos
+        ],
+        'next_cursor': next_cursor,
+        'next_url': next_url,
+    }), validators)
+
+app.register_blueprint(api_v1)
 
 @app.route('/add_attraction', methods=['GET', 'POST'])
 def add_attraction():
@@ -188,40 +992,55 @@ def add_attraction():
             # Add and commit the attraction first
             db.session.add(new_attraction)
             db.session.commit()
+            invalidate_listings(new_attraction)
+            if attraction_index.built:
+                attraction_index.add(
+                    new_attraction.id,
+                    new_attraction.latitude,
+                    new_attraction.longitude,
+                    index_tags(new_attraction)
+                )
 
             # Handle photo uploads
+            pending = []
+            blobs = []
             if 'photos' in request.files:
                 photos = request.files.getlist('photos')
                 photos_added = 0
                 
                 for photo in photos:
                     if photo and photo.filename:  # Ensure the file is not empty
+                        if not allowed_file(photo.filename):
+                            flash(f'Skipped {photo.filename}: unsupported file type', 'error')
+                            continue
                         try:
-                            filename = photo_processor.process_and_save_image(
-                                photo, 
-                                app.config['UPLOAD_FOLDER'], 
-                                target_size=(800, 600)
-                            )
-                            
                             # Create photo record
                             new_photo = Photo(
-                                filename=filename,
                                 attraction_id=new_attraction.id,
                                 user_id=1234,
                                 upload_date=datetime.utcnow()
                             )
-                            db.session.add(new_photo)
+
+                            # Store the upload by content and add the photo; renditions are produced in the background
+                            blob = blob_store.attach(new_photo, photo, app.config['UPLOAD_FOLDER'], target_size=(800, 600))
+                            pending.append(new_photo)
+                            if blob is not None:
+                                blobs.append(blob)
                             photos_added += 1
                         
                         except Exception as e:
-                            flash(f'Error processing image {photo.filename}: {str(e)}', 'error')
-                            app.logger.error(f'Image processing error: {str(e)}')
+                            flash(f'Error saving image {photo.filename}: {str(e)}', 'error')
+                            app.logger.error(f'Image upload error: {str(e)}')
                 
                 # Commit photo uploads
                 try:
                     db.session.commit()
+                    invalidate_attraction_cards(new_attraction.id)
+                    # All photos of the upload are processed in parallel as one job
+                    submit_blobs(blobs, target_size=(800, 600))
                     if photos_added > 0:
-                        flash(f'Successfully added {photos_added} photo(s) to the attraction.', 'success')
+                        flash(f'Successfully added {photos_added} photo(s) to the attraction. '
+                              'They will appear once processing finishes.', 'success')
                 except Exception as e:
                     db.session.rollback()
                     flash('Error saving photos. Please try again.', 'error')
@@ -229,7 +1048,11 @@ def add_attraction():
 
             # Flash success message and redirect
             flash('Attraction added successfully!', 'success')
-            return redirect(url_for('attraction_detail', attraction_id=new_attraction.id))
+            return redirect(url_for(
+                'attraction_detail',
+                attraction_id=new_attraction.id,
+                pending=[photo.id for photo in pending if photo.status == PENDING]
+            ))
 
         except ValueError as ve:
             # Handle potential value conversion errors
@@ -262,19 +1085,15 @@ def add_photo(attraction_id):
         flash('No selected file', 'danger')
         return redirect(url_for('attraction_detail', attraction_id=attraction_id))
     
-    # Generate unique filename
-    filename = generate_unique_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filepath)
-    
-    # Create photo entry
+    # Create photo entry, stored by content and processed in the background
     new_photo = Photo(
-        filename=filename,
         caption=request.form['caption'],
+        rating=int(request.form['rating']),
         attraction_id=attraction_id,
-        user_id=1234
+        user_id=1234,
+        upload_date=datetime.utcnow()
     )
-    db.session.add(new_photo)
+    blob = blob_store.attach(new_photo, file, app.config['UPLOAD_FOLDER'], target_size=(1200, 800))
     
     # Create review entry
     new_review = Review(
@@ -282,15 +1101,16 @@ def add_photo(attraction_id):
         comment=request.form['caption'],
         attraction_id=attraction_id,
         user_id=1234,
-        visit_date=datetime.utcnow()
+        visit_date=new_photo.upload_date
     )
     db.session.add(new_review)
     
-    # Update attraction statistics
-    attraction.total_visits += 1
-    attraction.average_rating = (attraction.average_rating * (attraction.total_visits - 1) + new_review.rating) / attraction.total_visits
+    # Update attraction statistics in place
+    attraction_stats.record_visit(attraction_id, new_review.rating)
     
     db.session.commit()
+    invalidate_attraction_cards(attraction_id)
+    submit_blobs([blob] if blob else [], target_size=(1200, 800))
     
     flash('Photo and review added successfully!', 'success')
     return redirect(url_for('attraction_detail', attraction_id=attraction_id))
@@ -306,6 +1126,7 @@ def login():
         
         if user and check_password_hash(user.password, password):
             login_user(user)
+            remember_principal(cache_user(user))
             flash('Login successful!', 'success')
             return redirect(url_for('index'))
         
@@ -345,17 +1166,27 @@ def register():
     return render_template('register.html')
 
 @app.route('/delete_photo/<int:photo_id>', methods=['POST'])
-@login_required
+@principal_required
 def delete_photo(photo_id):
     photo = Photo.query.get_or_404(photo_id)
     # Ensure only the owner or an admin can delete the photo
-    if photo.user_id != 1234 and not current_user.is_admin:
+    if photo.user_id != 1234 and not current_principal().is_admin:
         flash('You do not have permission to delete this photo.', 'danger')
         return redirect(url_for('attraction_detail', attraction_id=photo.attraction_id))
     
     attraction_id = photo.attraction_id
+    attraction = photo.attraction
+    if attraction.cover_photo_id == photo.id:
+        # Fall back to the oldest remaining photo
+        attraction.cover_photo = Photo.query.filter(
+            Photo.attraction_id == attraction_id,
+            Photo.id != photo.id,
+            Photo.status == READY
+        ).order_by(Photo.id).first()
+    blob_store.release(photo)
     db.session.delete(photo)
     db.session.commit()
+    invalidate_attraction_cards(attraction_id)
     flash('Photo deleted successfully!', 'success')
     return redirect(url_for('attraction_detail', attraction_id=attraction_id))
 
@@ -365,6 +1196,7 @@ def delete_photo(photo_id):
 def logout():
     """User logout"""
     logout_user()
+    session.pop('principal', None)
     flash('You have been logged out.', 'info')
     return redirect(url_for('index'))
 
@@ -375,5 +1207,32 @@ def profile():
     user_photos = Photo.query.filter_by(user_id=1234).order_by(Photo.upload_date.desc()).all()
     return render_template('profile.html', photos=user_photos)
 
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute attraction rating and visit aggregates from reviews"""
+    count = attraction_stats.rebuild()
+    print(f'Rebuilt statistics for {count} attraction(s)')
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if a hot query would scan a whole table instead of using an index"""
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException('Query plan checks only support SQLite')
+
+    failed = False
+    for name, details, problems in query_plans.check():
+        print(f"{'FAIL' if problems else 'ok'}  {name}")
+        for detail in details:
+            print(f'      {detail}')
+        failed = failed or bool(problems)
+    if failed:
+        raise click.ClickException('Some queries do not use an index')
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static files into static/dist"""
+    manifest = assets.build()
+    print(f"Built {len(manifest['assets'])} asset(s), {len(manifest['encodings'])} with compressed variants")
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,234 @@
+"""
+Fingerprinted, precompressed static assets.
+
+`build()` copies every file under the static folder (except uploads) to
+`<static>/dist` with a content hash in its name, e.g. style.css ->
+dist/style.0123456789abcdef.css, writes gzip and brotli variants of
+compressible files next to it, and records the mapping in
+dist/manifest.json. `Assets` rewrites url_for('static', ...) to the hashed
+names and serves files that cannot change under their name (hashed assets,
+content-addressed and uuid-named uploads) with far-future immutable
+caching, picking the precompressed variant the client accepts.
+
+Brotli variants need the optional `brotli` package; without it only gzip
+variants are written.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUILD_DIR = 'dist'
+MANIFEST = 'manifest.json'
+# Top-level folders of the static folder that are not build inputs
+EXCLUDE = ('uploads', BUILD_DIR)
+COMPRESSIBLE = {'.css', '.js', '.mjs', '.json', '.svg', '.txt', '.xml', '.html', '.map', '.ico'}
+# Smaller files are not worth a variant; the headers would outweigh the savings
+MIN_COMPRESS_SIZE = 256
+FINGERPRINT_LENGTH = 16
+ONE_YEAR = 365 * 24 * 60 * 60
+
+# Content-Encoding -> file suffix, in order of preference when qualities tie
+ENCODINGS = {
+    'br': '.br',
+    'gzip': '.gz',
+}
+
+# Upload names that are never reused for different content: a long hex digest
+# (blobs, QR codes) or a uuid prefix (photos from before content addressing)
+IMMUTABLE_UPLOAD = re.compile(r'[0-9a-f]{16,}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+def fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:FINGERPRINT_LENGTH]
+
+
+def hashed_name(filename, digest):
+    """style.css -> style.<digest>.css, keeping the folder"""
+    stem, ext = os.path.splitext(filename)
+    return f'{stem}.{digest}{ext}'
+
+
+def compress(data):
+    """
+    Precompressed variants of data, at the highest compression levels.
+
+    Returns:
+    - Dict of Content-Encoding -> compressed bytes, only for variants
+      smaller than data
+    """
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: compressed for encoding, compressed in variants.items() if len(compressed) < len(data)}
+
+
+def _write_atomic(path, data):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def build(static_folder):
+    """
+    Fingerprint and precompress the static assets, replacing the previous build.
+
+    Args:
+    - static_folder: The app's static folder
+
+    Returns:
+    - Manifest dict with 'assets' (filename -> hashed filename, both relative
+      to static_folder) and 'encodings' (hashed filename -> encodings written)
+    """
+    build_folder = os.path.join(static_folder, BUILD_DIR)
+    manifest = {'assets': {}, 'encodings': {}}
+    written = set()
+
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder:
+            dirs[:] = [name for name in dirs if name not in EXCLUDE]
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            filename = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            target = f'{BUILD_DIR}/{hashed_name(filename, fingerprint(source))}'
+            target_path = os.path.join(static_folder, *target.split('/'))
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            if not os.path.exists(target_path):
+                shutil.copyfile(source, target_path)
+            manifest['assets'][filename] = target
+            written.add(target_path)
+
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE or os.path.getsize(source) < MIN_COMPRESS_SIZE:
+                continue
+            with open(source, 'rb') as f:
+                variants = compress(f.read())
+            for encoding, data in variants.items():
+                variant_path = target_path + ENCODINGS[encoding]
+                if not os.path.exists(variant_path):
+                    _write_atomic(variant_path, data)
+                written.add(variant_path)
+            manifest['encodings'][target] = sorted(variants)
+
+    # Remove files of earlier builds
+    for root, _, files in os.walk(build_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            if path not in written and name != MANIFEST:
+                os.remove(path)
+
+    os.makedirs(build_folder, exist_ok=True)
+    _write_atomic(os.path.join(build_folder, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(static_folder):
+    """The manifest of the last build, or an empty one if nothing was built"""
+    try:
+        with open(os.path.join(static_folder, BUILD_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'assets': {}, 'encodings': {}}
+
+
+def choose_encoding(accept_encodings, available):
+    """
+    Pick the variant to send.
+
+    Args:
+    - accept_encodings: The request's parsed Accept-Encoding header
+    - available: Encodings with a precompressed file
+
+    Returns:
+    - The accepted encoding with the highest quality, or None for the plain file
+    """
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        quality = accept_encodings[encoding]
+        if encoding in available and quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class Assets:
+    """
+    Flask extension serving the build written by build().
+
+    Templates keep calling url_for('static', filename='style.css'); the URL
+    points at the hashed file once a build exists and at the plain file
+    before that.
+    """
+
+    def __init__(self, app=None):
+        self.manifest = {'assets': {}, 'encodings': {}}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.reload()
+        app.url_defaults(self._rewrite_url)
+        app.view_functions['static'] = self.send_static_file
+        app.extensions['assets'] = self
+
+    def reload(self):
+        self.manifest = load_manifest(self.app.static_folder)
+
+    def build(self):
+        self.manifest = build(self.app.static_folder)
+        return self.manifest
+
+    def _rewrite_url(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.manifest['assets'].get(values['filename'], values['filename'])
+
+    def is_immutable(self, filename):
+        """Whether the file's content can never change under this name"""
+        if filename.startswith(BUILD_DIR + '/'):
+            return filename in self.manifest['encodings'] or filename in self.manifest['assets'].values()
+        return filename.startswith('uploads/') and bool(IMMUTABLE_UPLOAD.search(os.path.basename(filename)))
+
+    def _encodings(self, filename):
+        if filename in self.manifest['encodings']:
+            return self.manifest['encodings'][filename]
+        if filename.startswith(BUILD_DIR + '/') or os.path.splitext(filename)[1].lower() not in COMPRESSIBLE:
+            return []
+        # Variants stored next to an upload, e.g. written by another tool
+        path = safe_join(self.app.static_folder, filename)
+        return [encoding for encoding, suffix in ENCODINGS.items() if path and os.path.isfile(path + suffix)]
+
+    def send_static_file(self, filename):
+        """View for the 'static' endpoint"""
+        if not self.is_immutable(filename):
+            return self.app.send_static_file(filename)
+
+        available = self._encodings(filename)
+        encoding = choose_encoding(request.accept_encodings, available)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(
+            self.app.static_folder, filename + (ENCODINGS[encoding] if encoding else ''),
+            mimetype=mimetype, max_age=ONE_YEAR
+        )
+        if encoding:
+            response.content_encoding = encoding
+        if available:
+            response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
@@ -0,0 +1,73 @@
+from sqlalchemy import func
+
+from models import db, Attraction, Review
+
+
+def record_visit(attraction_id, rating):
+    """
+    Add one rated visit to an attraction's running aggregates.
+
+    The sum, count and average are changed by a single UPDATE evaluated by
+    the database, so concurrent visits never overwrite each other and no
+    row has to be read first. Nothing is committed.
+
+    Args:
+    - attraction_id: Attraction being rated
+    - rating: Rating given for the visit
+    """
+    db.session.execute(
+        db.update(Attraction)
+        .where(Attraction.id == attraction_id)
+        .values(
+            rating_sum=Attraction.rating_sum + rating,
+            total_visits=Attraction.total_visits + 1,
+            # SET expressions see the old row, so this includes the new rating
+            average_rating=(Attraction.rating_sum + rating) * 1.0 / (Attraction.total_visits + 1)
+        )
+    )
+
+
+def rebuild():
+    """
+    Recompute every attraction's aggregates from its reviews.
+
+    Each rated visit is recorded as a Review, so one grouped pass over the
+    review table gives the sums and counts. Attractions without reviews
+    keep their average and visit count, which were entered or counted
+    before visits were reviews; only their sum is derived again from them,
+    as migration 5e2b9d4c7a16 does. Commits.
+
+    Returns:
+    - Number of attractions updated
+    """
+    totals = {
+        attraction_id: (rating_sum, count)
+        for attraction_id, rating_sum, count in db.session.query(
+            Review.attraction_id, func.sum(Review.rating), func.count(Review.id)
+        ).group_by(Review.attraction_id)
+    }
+
+    rows = []
+    attractions = db.session.query(Attraction.id, Attraction.average_rating, Attraction.total_visits)
+    for attraction_id, average_rating, total_visits in attractions:
+        if attraction_id in totals:
+            rating_sum, count = totals[attraction_id]
+            rows.append({
+                'id': attraction_id,
+                'rating_sum': rating_sum,
+                'total_visits': count,
+                'average_rating': rating_sum / count,
+            })
+        else:
+            rows.append({
+                'id': attraction_id,
+                'rating_sum': round((average_rating or 0) * (total_visits or 0)),
+                'total_visits': total_visits or 0,
+                'average_rating': average_rating or 0,
+            })
+
+    if rows:
+        # Bulk UPDATE by primary key, executed as one batched statement
+        db.session.execute(db.update(Attraction), rows)
+    db.session.commit()
+    return len(rows)
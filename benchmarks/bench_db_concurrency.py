@@ -0,0 +1,146 @@
+"""
+Benchmark concurrent read/write throughput of SQLite with and without the tuning pragmas.
+
+Reader threads run the listing query (ranking columns filtered by
+category) while writer threads record rated visits the way the app does:
+an atomic aggregate UPDATE plus a Review insert per transaction. Each
+profile gets a fresh database file with the same seeded rows.
+
+Usage:
+    python benchmarks/bench_db_concurrency.py [--readers 4] [--writers 2] [--seconds 5] [--attractions 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, insert, select, update
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from models import db, Attraction, AttractionCategory, Review, WeatherSuitability
+
+attractions = Attraction.__table__
+reviews = Review.__table__
+
+
+def make_engine(path, tuned, pool_size):
+    url = f'sqlite:///{path}'
+    engine = create_engine(url, **database.engine_options(url, pool_size=pool_size, max_overflow=0))
+    if tuned:
+        database.tune(engine)
+    return engine
+
+
+def seed(engine, count):
+    db.metadata.create_all(engine)
+    categories = list(AttractionCategory)
+    weathers = list(WeatherSuitability)
+    rng = random.Random(42)
+    rows = [
+        {
+            'name': f'Attraction {i}',
+            'description': 'Benchmark row',
+            'latitude': 29.6 + rng.uniform(-1, 1),
+            'longitude': -81.2 + rng.uniform(-1, 1),
+            'category': categories[i % len(categories)],
+            'weather_suitability': weathers[i % len(weathers)],
+            'average_rating': 0,
+            'total_visits': 0,
+            'rating_sum': 0,
+        }
+        for i in range(count)
+    ]
+    with engine.begin() as conn:
+        conn.execute(insert(attractions), rows)
+
+
+def reader(engine, stop, counts, errors):
+    categories = list(AttractionCategory)
+    rng = random.Random()
+    while not stop.is_set():
+        query = select(attractions.c.id, attractions.c.latitude, attractions.c.longitude).where(
+            attractions.c.category == rng.choice(categories)
+        )
+        try:
+            with engine.connect() as conn:
+                conn.execute(query).all()
+            counts['reads'] += 1
+        except OperationalError:
+            errors['reads'] += 1
+
+
+def writer(engine, stop, count, counts, errors):
+    rng = random.Random()
+    while not stop.is_set():
+        attraction_id = rng.randint(1, count)
+        rating = rng.randint(1, 5)
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    update(attractions).where(attractions.c.id == attraction_id).values(
+                        rating_sum=attractions.c.rating_sum + rating,
+                        total_visits=attractions.c.total_visits + 1,
+                        average_rating=(attractions.c.rating_sum + rating) * 1.0 / (attractions.c.total_visits + 1)
+                    )
+                )
+                conn.execute(insert(reviews).values(
+                    rating=rating, comment='bench', visit_date=datetime.utcnow(),
+                    attraction_id=attraction_id, user_id=1
+                ))
+            counts['writes'] += 1
+        except OperationalError:
+            errors['writes'] += 1
+
+
+def run(tuned, args):
+    with tempfile.TemporaryDirectory() as workdir:
+        engine = make_engine(os.path.join(workdir, 'bench.db'), tuned, args.readers + args.writers)
+        seed(engine, args.attractions)
+
+        # Counters are only ever incremented by one thread each, via per-thread dicts
+        stop = threading.Event()
+        reader_stats = [({'reads': 0}, {'reads': 0}) for _ in range(args.readers)]
+        writer_stats = [({'writes': 0}, {'writes': 0}) for _ in range(args.writers)]
+        threads = [threading.Thread(target=reader, args=(engine, stop) + stats) for stats in reader_stats]
+        threads += [threading.Thread(target=writer, args=(engine, stop, args.attractions) + stats)
+                    for stats in writer_stats]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        engine.dispose()
+
+    reads = sum(counts['reads'] for counts, _ in reader_stats)
+    writes = sum(counts['writes'] for counts, _ in writer_stats)
+    failures = sum(errors['reads'] for _, errors in reader_stats) + sum(errors['writes'] for _, errors in writer_stats)
+    return reads / elapsed, writes / elapsed, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--attractions', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'profile':>8} {'reads/s':>10} {'writes/s':>10} {'errors':>8}")
+    for tuned in (False, True):
+        reads, writes, failures = run(tuned, args)
+        print(f"{'tuned' if tuned else 'default':>8} {reads:>10.1f} {writes:>10.1f} {failures:>8}")
+
+
+if __name__ == '__main__':
+    main()
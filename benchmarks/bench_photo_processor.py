@@ -0,0 +1,91 @@
+"""
+Benchmark photo_processor with and without the decode-time downscaling fast path.
+
+Generates phone-camera sized JPEGs, then processes each one in a fresh
+subprocess so that peak RSS (which includes Pillow's C allocations) is
+measured per mode. Also reports how far the fast-path output drifts from
+the full-decode output.
+
+Usage:
+    python benchmarks/bench_photo_processor.py [--megapixels 12 24 48] [--runs 3]
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageChops, ImageStat
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import photo_processor
+
+
+def make_jpeg(path, megapixels):
+    """Write a 4:3 JPEG with enough detail that encode and resize do real work"""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    noise = Image.effect_noise((width // 8, height // 8), 64).convert('RGB')
+    gradient = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    img = Image.blend(noise.resize((width, height), Image.BICUBIC), gradient, 0.5)
+    img.save(path, 'JPEG', quality=92)
+    return width, height
+
+
+def run_once(path, output_dir, fast, results):
+    start = time.perf_counter()
+    renditions = photo_processor.process_and_save_renditions(
+        path, output_dir, target_size=(1200, 800), filename='bench.jpg', fast=fast
+    )
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    results.put((elapsed, peak, renditions['full']['jpeg']))
+
+
+def measure(path, output_dir, fast):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_once, args=(path, output_dir, fast, results))
+    process.start()
+    outcome = results.get()
+    process.join()
+    return outcome
+
+
+def mean_abs_difference(path_a, path_b):
+    diff = ImageChops.difference(Image.open(path_a).convert('RGB'), Image.open(path_b).convert('RGB'))
+    return sum(ImageStat.Stat(diff).mean) / 3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megapixels', type=int, nargs='+', default=[12, 24, 48])
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        print(f"{'size':>12} {'mode':>6} {'time (ms)':>10} {'peak RSS (MB)':>14} {'mean |diff|':>12}")
+        for megapixels in args.megapixels:
+            source = os.path.join(workdir, f'source_{megapixels}mp.jpg')
+            width, height = make_jpeg(source, megapixels)
+
+            outputs = {}
+            for fast in (False, True):
+                times, peaks = [], []
+                for _ in range(args.runs):
+                    elapsed, peak, output = measure(source, workdir, fast)
+                    times.append(elapsed)
+                    peaks.append(peak)
+                outputs[fast] = os.path.join(workdir, output)
+                diff = mean_abs_difference(outputs[False], outputs[True]) if fast else 0.0
+                print(f"{width}x{height:<6} {'fast' if fast else 'full':>6} "
+                      f"{min(times) * 1000:>10.1f} {max(peaks) / 1024:>14.1f} {diff:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
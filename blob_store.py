@@ -0,0 +1,155 @@
+import hashlib
+import os
+import tempfile
+
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from models import db, Attraction, Blob
+from image_queue import PENDING, READY, FAILED
+
+# Bytes read from the upload stream at a time while hashing
+CHUNK_SIZE = 64 * 1024
+
+
+def variant_name(target_size):
+    """Name of the rendition set produced for a full-size target, e.g. '1200x800'"""
+    return f'{target_size[0]}x{target_size[1]}'
+
+
+def stream_to_raw(upload, upload_folder, variant, subfolder='raw'):
+    """
+    Copy an upload into the raw folder, hashing the bytes as they stream in.
+
+    The file is named after its SHA-256 digest and the variant it is stored
+    for, so identical uploads map to the same raw file while the blob of
+    another variant keeps its own copy until it is processed.
+
+    Args:
+    - upload: FileStorage object from Flask
+    - upload_folder: Directory for processed images; raw files go in a subfolder
+    - variant: Name of the rendition set, see variant_name()
+    - subfolder: Subfolder of upload_folder for raw uploads
+
+    Returns:
+    - Tuple of (hex digest, raw filename relative to upload_folder)
+    """
+    raw_dir = os.path.join(upload_folder, subfolder)
+    os.makedirs(raw_dir, exist_ok=True)
+
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=raw_dir, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = upload.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    ext = os.path.splitext(secure_filename(upload.filename or ''))[1].lower()
+    raw_filename = f'{subfolder}/{digest.hexdigest()}_{variant}{ext}'
+    os.replace(temp_path, os.path.join(upload_folder, raw_filename))
+    return digest.hexdigest(), raw_filename
+
+
+def _link(photo, blob, filename, status):
+    """Complete a photo, add it to the session, then point it at its blob"""
+    photo.filename = filename
+    photo.status = status
+    db.session.add(photo)
+    photo.blob = blob
+
+
+def attach(photo, upload, upload_folder, target_size):
+    """
+    Store an upload content-addressed and point a new Photo at its blob.
+
+    If the same bytes were already stored for this target size, the existing
+    blob gets another reference and the photo reuses its renditions without
+    any processing. The photo is added to the session; nothing is committed.
+
+    Args:
+    - photo: New, unsaved Photo
+    - upload: FileStorage object from Flask
+    - upload_folder: Directory for processed images
+    - target_size: Tuple of (width, height) of the full-size rendition
+
+    Returns:
+    - The Blob to submit for processing, or None if the photo is already ready.
+      A blob that is already pending is returned too, so the photo is picked
+      up even if the blob finishes before it is committed; the queue skips
+      blobs it is already processing.
+    """
+    variant = variant_name(target_size)
+    digest, raw_filename = stream_to_raw(upload, upload_folder, variant)
+
+    blob = Blob.query.filter_by(digest=digest, variant=variant).first()
+    if blob is None:
+        blob = Blob(digest=digest, variant=variant, filename=raw_filename, status=PENDING, ref_count=1)
+        try:
+            with db.session.begin_nested():
+                db.session.add(blob)
+        except IntegrityError:
+            # The same bytes were stored by a concurrent upload first
+            blob = Blob.query.filter_by(digest=digest, variant=variant).one()
+        else:
+            _link(photo, blob, raw_filename, PENDING)
+            return blob
+
+    db.session.execute(
+        db.update(Blob).where(Blob.id == blob.id).values(ref_count=Blob.ref_count + 1)
+    )
+
+    if blob.status == FAILED:
+        # The bytes are back on disk; give processing another go
+        blob.status = PENDING
+        blob.filename = raw_filename
+        blob.processing_error = None
+        _link(photo, blob, raw_filename, PENDING)
+        return blob
+
+    if blob.status == PENDING:
+        # The worker updates every photo of the blob; keep one raw copy of the bytes
+        if raw_filename != blob.filename:
+            if os.path.exists(os.path.join(upload_folder, blob.filename)):
+                os.remove(os.path.join(upload_folder, raw_filename))
+            else:
+                blob.filename = raw_filename
+        _link(photo, blob, blob.filename, PENDING)
+        return blob
+
+    # Only a pending blob of this variant could need this raw file
+    os.remove(os.path.join(upload_folder, raw_filename))
+    photo.renditions = blob.renditions
+    _link(photo, blob, blob.filename, READY)
+
+    attraction = db.session.get(Attraction, photo.attraction_id)
+    if attraction is not None and attraction.cover_photo is None:
+        attraction.cover_photo = photo
+    return None
+
+
+def release(photo):
+    """
+    Drop a photo's reference to its blob, deleting the blob row when unused.
+
+    Call before deleting the photo; nothing is committed. The blob's files
+    are left on disk.
+    """
+    if photo.blob_id is None:
+        return
+
+    blob_id = photo.blob_id
+    photo.blob_id = None
+    db.session.flush()
+    db.session.execute(
+        db.update(Blob).where(Blob.id == blob_id).values(ref_count=Blob.ref_count - 1)
+    )
+    db.session.execute(
+        db.delete(Blob).where(Blob.id == blob_id, Blob.ref_count <= 0)
+    )
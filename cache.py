@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TaggedCache:
+    """
+    Thread-safe in-memory LRU cache with a time-to-live and tag-based invalidation.
+
+    Each entry is stored with a set of tags naming the data it was built
+    from. Writers invalidate by tag, dropping exactly the entries that
+    depend on what changed. Entries also expire after ttl seconds, which
+    bounds staleness when a write happens in another process.
+    """
+
+    def __init__(self, max_entries=256, ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Look up a cached value, marking it as recently used.
+
+        Returns:
+        - The cached value, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, tags, expires = entry
+            if expires <= self._clock():
+                self._discard(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, tags=()):
+        """
+        Store a value, evicting the least recently used entry when full.
+
+        Args:
+        - key: Hashable cache key
+        - value: Value to cache; None cannot be cached
+        - tags: Names of the data the value depends on, see invalidate()
+        """
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            tags = frozenset(tags)
+            self._entries[key] = (value, tags, self._clock() + self.ttl)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, *tags):
+        """
+        Drop every entry stored with any of the given tags.
+
+        Returns:
+        - Number of entries dropped
+        """
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys |= self._tags.get(tag, set())
+            for key in keys:
+                self._discard(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _discard(self, key):
+        _, tags, _ = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class VersionStamps:
+    """
+    Thread-safe in-memory version stamps, used as validators for conditional GETs.
+
+    A key's stamp is the time it was last bumped, never earlier than when
+    the stamps were created, so versions handed out before a restart are
+    not reused after it. Stamps only see bumps made in this process; to
+    bound staleness under several processes every stamp also moves forward
+    at least once per max_age seconds.
+    """
+
+    def __init__(self, max_age=300, clock=time.time):
+        self.max_age = max_age
+        self._clock = clock
+        self._started = clock()
+        self._last = self._started
+        self._stamps = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns:
+        - The key's current stamp, a Unix timestamp
+        """
+        now = self._clock()
+        return max(self._stamps.get(key, self._started), now - now % self.max_age)
+
+    def bump(self, *keys):
+        """Give the keys a new stamp, later than every stamp handed out so far"""
+        with self._lock:
+            self._last = max(self._clock(), self._last + 1e-6)
+            for key in keys:
+                self._stamps[key] = self._last
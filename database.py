@@ -0,0 +1,120 @@
+import os
+
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from models import db
+
+DEFAULT_DATABASE_URL = 'sqlite:///attraction.db'
+# Same folder as app.py uses
+UPLOAD_FOLDER = 'static/uploads'
+
+# Applied to every new SQLite connection. WAL lets readers proceed while
+# the single writer commits; NORMAL sync is durable in WAL mode except for
+# the last transactions on power loss.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative values are KiB, so this is a 64MB page cache per connection
+    'cache_size': -64 * 1024,
+    # Milliseconds a connection waits for the write lock before failing
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+
+
+def configure(app):
+    """
+    Fill in the database settings of a Flask app from the environment.
+
+    Environment variables:
+    - DATABASE_URL: SQLAlchemy URL, defaults to the local SQLite file
+    - DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW: Connection pool sizing
+    - DATABASE_POOL_TIMEOUT: Seconds to wait for a free pooled connection
+    - DATABASE_POOL_RECYCLE: Seconds after which pooled connections are replaced
+
+    Values already present in app.config win over the environment.
+    """
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL))
+    app.config.setdefault('SQLITE_PRAGMAS', dict(SQLITE_PRAGMAS))
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(
+        app.config['SQLALCHEMY_DATABASE_URI'],
+        pool_size=_env_int('DATABASE_POOL_SIZE'),
+        max_overflow=_env_int('DATABASE_MAX_OVERFLOW'),
+        pool_timeout=_env_int('DATABASE_POOL_TIMEOUT'),
+        pool_recycle=_env_int('DATABASE_POOL_RECYCLE'),
+    ))
+
+
+def create_script_app():
+    """
+    Minimal Flask app for command-line scripts that work on the app's database.
+
+    Configured like the web app (see configure()), with the same upload
+    folder, but without its routes, caches and background workers.
+
+    Returns:
+    - Flask app with the models' SQLAlchemy extension initialized
+    """
+    app = Flask(__name__)
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    configure(app)
+    db.init_app(app)
+    return app
+
+
+def engine_options(url, pool_size=None, max_overflow=None, pool_timeout=None, pool_recycle=None):
+    """
+    SQLAlchemy create_engine options for a database URL.
+
+    Args:
+    - url: Database URL
+    - pool_size, max_overflow, pool_timeout, pool_recycle: Pool settings;
+      None keeps SQLAlchemy's default
+
+    Returns:
+    - Dict of engine options
+    """
+    options = {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        'pool_recycle': pool_recycle,
+    }
+    options = {key: value for key, value in options.items() if value is not None}
+
+    if make_url(url).get_backend_name() != 'sqlite':
+        # Server connections can be dropped behind our back; test them on checkout
+        options['pool_pre_ping'] = True
+    return options
+
+
+def tune(engine, pragmas=None):
+    """
+    Apply the SQLite tuning pragmas to every connection the engine opens.
+
+    Does nothing for other databases.
+
+    Args:
+    - engine: SQLAlchemy engine
+    - pragmas: Dict of pragma name -> value, defaults to SQLITE_PRAGMAS
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+def _env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
@@ -0,0 +1,365 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+
+from PIL import UnidentifiedImageError
+
+from models import db, Attraction, Blob, Photo
+import photo_processor
+
+logger = logging.getLogger(__name__)
+
+# Photo.status values
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+
+# Raised by ImageQueue.submit when the queue is at capacity
+QueueFull = queue.Full
+
+# Errors that another attempt cannot fix
+PERMANENT_ERRORS = (UnidentifiedImageError, FileNotFoundError)
+
+# Processes are started from worker threads of a multithreaded server. Forking
+# there would copy locks other threads hold into the children, so they are
+# started from a clean server process (or from scratch where that is missing).
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# processing_error values shown to users; the exception itself is only logged
+NOT_AN_IMAGE = 'The file could not be read as an image'
+PROCESSING_FAILED = 'Image processing failed'
+
+
+def variant_size(variant):
+    """Full-size target of a blob variant, e.g. '1200x800' -> (1200, 800)"""
+    width, height = variant.split('x')
+    return int(width), int(height)
+
+
+def ready_photos(blob):
+    """
+    Copy a finished blob onto its pending photos; nothing is committed.
+
+    Returns:
+    - Set of ids of the attractions those photos belong to
+    """
+    attraction_ids = set()
+    for photo in Photo.query.filter(Photo.blob_id == blob.id, Photo.status == PENDING).order_by(Photo.id):
+        photo.filename = blob.filename
+        photo.renditions = blob.renditions
+        photo.status = READY
+        photo.processing_error = None
+        attraction_ids.add(photo.attraction_id)
+
+        attraction = db.session.get(Attraction, photo.attraction_id)
+        if attraction is not None and attraction.cover_photo is None:
+            attraction.cover_photo = photo
+    return attraction_ids
+
+
+@dataclass
+class ImageJob:
+    # (blob_id, raw_filename) pairs processed together
+    blobs: list
+    target_size: tuple = (1200, 800)
+    attempts: int = 0
+
+
+class ImageQueue:
+    """
+    In-process queue that turns raw uploads into photo renditions off the request path.
+
+    Requests store the raw upload as a pending Blob (see blob_store) and
+    submit a job. Worker threads take jobs off the queue and spread each
+    job's images across a shared process pool, since resizing and encoding
+    are CPU-bound. Results are copied onto every Photo sharing the blob and
+    committed in one transaction per job; failed images are retried with a
+    delay and eventually marked failed. Threads and the process pool are
+    started on the first submit or request.
+
+    The queue itself lives in memory, so when it starts it also re-queues
+    the blobs an earlier process left pending, e.g. across a restart.
+    Blobs already queued or being processed are not queued again when
+    another upload of the same bytes is submitted; once their job is done
+    they get a follow-up job that only readies photos attached meanwhile.
+
+    on_ready, if set, is called with the ids of the attractions that gained
+    ready photos after each job's commit.
+    """
+
+    # Pending blobs re-queued per job by recover_pending()
+    RECOVER_BATCH_SIZE = 16
+
+    def __init__(self, app=None, workers=2, max_depth=64, max_attempts=3, retry_delay=2.0, on_ready=None):
+        self.on_ready = on_ready
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.process_workers = None
+        self._jobs = queue.Queue(maxsize=max_depth)
+        self._threads = []
+        self._executor = None
+        self._lock = threading.Lock()
+        self._recovery = None
+        # Queued or running blob id -> whether it was submitted again meanwhile
+        self._in_flight = {}
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('IMAGE_QUEUE_WORKERS', self.workers)
+        self.max_attempts = app.config.get('IMAGE_QUEUE_MAX_ATTEMPTS', self.max_attempts)
+        self.retry_delay = app.config.get('IMAGE_QUEUE_RETRY_DELAY', self.retry_delay)
+        self.process_workers = app.config.get('IMAGE_PROCESS_POOL_WORKERS', self.process_workers)
+        self._jobs = queue.Queue(maxsize=app.config.get('IMAGE_QUEUE_MAX_DEPTH', self._jobs.maxsize))
+        # Start on the first request too, so leftover pending uploads are picked up without a new one
+        app.before_request(self.start)
+
+    def __len__(self):
+        return self._jobs.qsize()
+
+    def full(self):
+        """True when submit would raise QueueFull"""
+        return self._jobs.full()
+
+    def submit(self, blob_id, raw_filename, target_size=(1200, 800)):
+        """
+        Queue a pending blob for processing.
+
+        Raises:
+        - QueueFull if the queue is at its maximum depth
+        """
+        self.submit_batch([(blob_id, raw_filename)], target_size)
+
+    def submit_batch(self, blobs, target_size=(1200, 800)):
+        """
+        Queue several pending blobs to be processed in parallel as one job.
+
+        Blobs already in flight are left out.
+
+        Args:
+        - blobs: List of (blob_id, raw_filename) pairs
+
+        Raises:
+        - QueueFull if the queue is at its maximum depth
+        """
+        self.start()
+        blobs = self._claim(blobs, resubmit=True)
+        if not blobs:
+            return
+        try:
+            self._jobs.put_nowait(ImageJob(blobs, tuple(target_size)))
+        except queue.Full:
+            self._release(blob_id for blob_id, _ in blobs)
+            raise
+
+    def _claim(self, blobs, resubmit=False):
+        """
+        Mark blobs as in flight.
+
+        Args:
+        - blobs: List of (blob_id, raw_filename) pairs
+        - resubmit: Remember blobs that are already in flight, so their photos
+          are readied again after the running job
+
+        Returns:
+        - The pairs that were not in flight yet
+        """
+        claimed = []
+        with self._lock:
+            for blob_id, raw_filename in blobs:
+                if blob_id in self._in_flight:
+                    self._in_flight[blob_id] = self._in_flight[blob_id] or resubmit
+                else:
+                    self._in_flight[blob_id] = False
+                    claimed.append((blob_id, raw_filename))
+        return claimed
+
+    def _release(self, blob_ids):
+        """
+        Mark blobs as no longer in flight.
+
+        Returns:
+        - Ids of those submitted again while they were in flight
+        """
+        with self._lock:
+            return [blob_id for blob_id in blob_ids if self._in_flight.pop(blob_id, False)]
+
+    def start(self):
+        """Start the worker threads, and on the first call the recovery of pending blobs"""
+        self._ensure_workers()
+        with self._lock:
+            if self._recovery is not None:
+                return
+            self._recovery = threading.Thread(target=self.recover_pending, name='image-queue-recovery', daemon=True)
+        self._recovery.start()
+
+    def recover_pending(self):
+        """
+        Queue the blobs that were already pending when the queue started.
+
+        Blobs are read in batches by id, one short query each, and queued
+        with a blocking put so recovery waits for room instead of failing.
+        Blobs another process finishes first are skipped by the worker.
+        """
+        with self.app.app_context():
+            newest = db.session.scalar(db.select(db.func.max(Blob.id)).where(Blob.status == PENDING))
+            last_id = 0
+            while newest is not None and last_id < newest:
+                rows = db.session.execute(
+                    db.select(Blob.id, Blob.filename, Blob.variant)
+                    .where(Blob.status == PENDING, Blob.id > last_id, Blob.id <= newest)
+                    .order_by(Blob.id)
+                    .limit(self.RECOVER_BATCH_SIZE)
+                ).all()
+                db.session.rollback()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                by_variant = {}
+                for row in rows:
+                    by_variant.setdefault(row.variant, []).append((row.id, row.filename))
+                for variant, blobs in by_variant.items():
+                    blobs = self._claim(blobs)
+                    if blobs:
+                        self._jobs.put(ImageJob(blobs, variant_size(variant)))
+                logger.info('Re-queued %s pending blob(s) up to id %s', len(rows), last_id)
+
+    def _ensure_workers(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name='image-queue-worker', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.process_workers,
+                                                     mp_context=multiprocessing.get_context(START_METHOD))
+            return self._executor
+
+    def _reset_pool(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            retry = []
+            try:
+                with self.app.app_context():
+                    retry = self._process(job)
+            except Exception:
+                logger.exception('Image job for blobs %s crashed', [blob_id for blob_id, _ in job.blobs])
+            finally:
+                self._finish(job, retry)
+                self._jobs.task_done()
+
+    def _finish(self, job, retry):
+        """Release a job's blobs, except those retried, and follow up on blobs submitted meanwhile"""
+        retried = {blob_id for blob_id, _ in retry}
+        done = [(blob_id, raw_filename) for blob_id, raw_filename in job.blobs if blob_id not in retried]
+        resubmitted = set(self._release(blob_id for blob_id, _ in done))
+        follow_up = self._claim([item for item in done if item[0] in resubmitted])
+        if follow_up:
+            # Finished blobs only get their new photos readied; pending ones are processed again
+            self._retry(ImageJob(follow_up, job.target_size))
+
+    def _process(self, job):
+        ids = [blob_id for blob_id, _ in job.blobs]
+        blobs = {blob.id: blob for blob in Blob.query.filter(Blob.id.in_(ids))}
+        attraction_ids = set()
+
+        # Photos attached to a blob just as it was finished were missed by that job
+        for blob in blobs.values():
+            if blob.status == READY:
+                attraction_ids.update(ready_photos(blob))
+            elif blob.status == FAILED:
+                self._fail_photos(blob)
+
+        items = [
+            (blob_id, raw_filename) for blob_id, raw_filename in job.blobs
+            if blob_id in blobs and blobs[blob_id].status == PENDING
+        ]
+        if not items:
+            db.session.commit()
+            if attraction_ids and self.on_ready is not None:
+                self.on_ready(*attraction_ids)
+            return []
+
+        upload_folder = self.app.config['UPLOAD_FOLDER']
+        raw_paths = [os.path.join(upload_folder, raw_filename) for _, raw_filename in items]
+        # Output files are named after the content so duplicates never get re-encoded
+        stems = [f'{blobs[blob_id].digest}_{blobs[blob_id].variant}' for blob_id, _ in items]
+
+        executor = self._pool()
+        results = photo_processor.process_batch(raw_paths, upload_folder, job.target_size,
+                                                executor=executor, stems=stems)
+        if any(isinstance(result, BrokenProcessPool) for result in results):
+            # A worker process died; start a fresh pool for the retry
+            self._reset_pool(executor)
+
+        retry = []
+        processed = []
+        for (blob_id, raw_filename), raw_path, result in zip(items, raw_paths, results):
+            blob = blobs[blob_id]
+            if isinstance(result, Exception):
+                if job.attempts + 1 < self.max_attempts and not isinstance(result, PERMANENT_ERRORS):
+                    logger.warning('Image job for blob %s failed (attempt %s), retrying: %s',
+                                   blob_id, job.attempts + 1, result)
+                    retry.append((blob_id, raw_filename))
+                else:
+                    logger.error('Image job for blob %s (%s) failed permanently: %r', blob_id, raw_filename, result)
+                    blob.status = FAILED
+                    blob.processing_error = NOT_AN_IMAGE if isinstance(result, UnidentifiedImageError) else PROCESSING_FAILED
+                    self._fail_photos(blob)
+                continue
+
+            blob.filename = result['full']['jpeg']
+            blob.renditions = result
+            blob.status = READY
+            processed.append(raw_path)
+            attraction_ids.update(ready_photos(blob))
+
+        # Everything this job finished lands in a single transaction
+        db.session.commit()
+        if attraction_ids and self.on_ready is not None:
+            self.on_ready(*attraction_ids)
+
+        for raw_path in processed:
+            try:
+                os.remove(raw_path)
+            except OSError:
+                pass
+
+        if retry:
+            self._schedule_retry(ImageJob(retry, job.target_size, job.attempts + 1))
+        return retry
+
+    def _fail_photos(self, blob):
+        for photo in Photo.query.filter(Photo.blob_id == blob.id, Photo.status == PENDING):
+            photo.status = FAILED
+            photo.processing_error = blob.processing_error
+
+    def _schedule_retry(self, job):
+        timer = threading.Timer(self.retry_delay, self._retry, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def _retry(self, job):
+        try:
+            self._jobs.put_nowait(job)
+        except queue.Full:
+            # Still out of room; try again after another delay
+            self._schedule_retry(job)
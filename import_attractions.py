@@ -0,0 +1,330 @@
+"""
+Bulk import attractions, and optionally their photos, from CSV or JSON Lines.
+
+Records are streamed from the file and inserted in batches, one
+transaction per batch. Matching photos are hashed, stored
+content-addressed (see blob_store) and processed into renditions across a
+process pool. After every batch the number of records done is saved to a
+checkpoint file, so an interrupted import continues where it stopped.
+
+Each record has: name, description, latitude, longitude, category,
+weather_suitability (enum name or value) and optionally photo (file name
+in --photo-folder). Without a photo field, `<name>.jpg` or `<name>.jpeg`
+is used if present. Imported attractions start without ratings, like
+attractions added in the app; ratings come from reviews.
+
+Usage:
+    python import_attractions.py attractions.csv [--photo-folder DIR] [--batch-size 1000]
+                                 [--workers N] [--restart]
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import insert
+
+import blob_store
+import database
+import photo_processor
+from image_queue import READY, ready_photos
+from models import db, Attraction, AttractionCategory, Blob, Photo, WeatherSuitability
+
+# Full-size rendition of imported photos, as for photos added with a new attraction
+TARGET_SIZE = (800, 600)
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg')
+IMPORT_USER_ID = 1234
+
+
+def read_records(path):
+    """
+    Stream records from a .csv or .jsonl/.ndjson file as dicts.
+
+    A JSON line that does not parse is yielded as its ValueError, so it is
+    skipped like any other invalid record instead of ending the import.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as e:
+                        yield e
+
+
+def _enum(enum_class, value):
+    value = str(value).strip()
+    if value in enum_class.__members__:
+        return enum_class[value]
+    return enum_class(value)
+
+
+def to_row(record):
+    """
+    Validate a record and convert it to Attraction column values.
+
+    Raises:
+    - ValueError or KeyError if the record is incomplete or invalid
+    """
+    latitude, longitude = float(record['latitude']), float(record['longitude'])
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError(f'coordinates out of range: {latitude}, {longitude}')
+    return {
+        'name': record['name'].strip(),
+        'description': record['description'],
+        'latitude': latitude,
+        'longitude': longitude,
+        'category': _enum(AttractionCategory, record['category']),
+        'weather_suitability': _enum(WeatherSuitability, record['weather_suitability']),
+        'average_rating': 0,
+        'total_visits': 0,
+        'rating_sum': 0,
+    }
+
+
+def find_photo(record, photo_folder):
+    """Path of the record's photo in photo_folder, or None"""
+    if not photo_folder:
+        return None
+    candidates = [record['photo']] if record.get('photo') else [record['name'] + ext for ext in PHOTO_EXTENSIONS]
+    for candidate in candidates:
+        path = os.path.join(photo_folder, candidate)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(blob_store.CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    """Number of records of an input file already imported, kept next to the file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)['records']
+        except FileNotFoundError:
+            return 0
+
+    def save(self, records):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix='.part')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'records': records}, f)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Importer:
+    def __init__(self, upload_folder, photo_folder=None, executor=None):
+        self.upload_folder = upload_folder
+        self.photo_folder = photo_folder
+        self.executor = executor
+        self.variant = blob_store.variant_name(TARGET_SIZE)
+        self.attractions = 0
+        self.photos = 0
+        self.skipped = 0
+
+    def import_batch(self, records, skip_existing=False):
+        """
+        Insert one batch of records and their photos in a single transaction.
+
+        Args:
+        - records: List of (line number, record) pairs
+        - skip_existing: Leave out records whose attraction already exists,
+          for the first batch after resuming
+        """
+        rows, photos = [], []
+        for number, record in records:
+            try:
+                if isinstance(record, ValueError):
+                    raise record
+                rows.append(to_row(record))
+                photos.append(find_photo(record, self.photo_folder))
+            except (KeyError, ValueError, TypeError, AttributeError) as e:
+                print(f'Record {number}: skipped, {e!r}', file=sys.stderr)
+                self.skipped += 1
+
+        if skip_existing and rows:
+            existing = set(
+                db.session.query(Attraction.name, Attraction.latitude, Attraction.longitude)
+                .filter(Attraction.name.in_({row['name'] for row in rows}))
+            )
+            keep = [(row['name'], row['latitude'], row['longitude']) not in existing for row in rows]
+            rows = [row for row, kept in zip(rows, keep) if kept]
+            photos = [photo for photo, kept in zip(photos, keep) if kept]
+
+        if rows:
+            # executemany with RETURNING, ids in the order of rows
+            ids = db.session.scalars(
+                insert(Attraction).returning(Attraction.id, sort_by_parameter_order=True), rows
+            ).all()
+            self._import_photos([
+                (attraction_id, row['name'], path) for attraction_id, row, path in zip(ids, rows, photos) if path
+            ])
+        db.session.commit()
+        self.attractions += len(rows)
+
+    def _import_photos(self, items):
+        if not items:
+            return
+
+        digests = [file_digest(path) for _, _, path in items]
+        blobs = {
+            blob.digest: blob
+            for blob in Blob.query.filter(Blob.variant == self.variant, Blob.digest.in_(set(digests)),
+                                          Blob.status == READY)
+        }
+        # Uploads of the same image still pending or failed in the app; processed here and finished in place
+        unfinished = {
+            blob.digest: blob
+            for blob in Blob.query.filter(Blob.variant == self.variant, Blob.digest.in_(set(digests)),
+                                          Blob.status != READY)
+        }
+
+        # Process each new image once, in parallel, named after its content
+        new = {}
+        for (_, _, path), digest in zip(items, digests):
+            if digest not in blobs and digest not in new:
+                new[digest] = path
+        results = photo_processor.process_batch(
+            list(new.values()), self.upload_folder, TARGET_SIZE, executor=self.executor,
+            stems=[f'{digest}_{self.variant}' for digest in new]
+        ) if new else []
+        for (digest, path), result in zip(new.items(), results):
+            if isinstance(result, Exception):
+                print(f'{path}: not imported, {result!r}', file=sys.stderr)
+                continue
+            blob = unfinished.get(digest)
+            if blob is None:
+                blob = Blob(digest=digest, variant=self.variant, ref_count=0)
+                db.session.add(blob)
+            blob.filename = result['full']['jpeg']
+            blob.renditions = result
+            blob.status = READY
+            blob.processing_error = None
+            if digest in unfinished:
+                # The app's photos waiting for this upload get the renditions too
+                ready_photos(blob)
+            blobs[digest] = blob
+        db.session.flush()
+
+        photo_rows = []
+        references = Counter()
+        for (attraction_id, name, _), digest in zip(items, digests):
+            blob = blobs.get(digest)
+            if blob is None:
+                continue
+            references[blob.id] += 1
+            photo_rows.append({
+                'filename': blob.filename,
+                'renditions': blob.renditions,
+                'caption': f'Photo of {name}',
+                'attraction_id': attraction_id,
+                'user_id': IMPORT_USER_ID,
+                'status': READY,
+                'blob_id': blob.id,
+            })
+        if not photo_rows:
+            return
+
+        for blob_id, count in references.items():
+            db.session.execute(
+                db.update(Blob).where(Blob.id == blob_id).values(ref_count=Blob.ref_count + count)
+            )
+        photo_ids = db.session.scalars(
+            insert(Photo).returning(Photo.id, sort_by_parameter_order=True), photo_rows
+        ).all()
+        db.session.execute(db.update(Attraction), [
+            {'id': row['attraction_id'], 'cover_photo_id': photo_id}
+            for row, photo_id in zip(photo_rows, photo_ids)
+        ])
+        self.photos += len(photo_ids)
+
+
+def run_import(path, upload_folder, photo_folder=None, batch_size=1000, workers=None, restart=False):
+    """
+    Import a file batch by batch, resuming from its checkpoint unless restart is set.
+
+    Returns:
+    - The Importer, holding attraction, photo and skipped record counts
+    """
+    checkpoint = Checkpoint(path + '.progress')
+    if restart:
+        checkpoint.clear()
+    done = checkpoint.load()
+    if done:
+        print(f'Resuming after record {done}')
+
+    os.makedirs(upload_folder, exist_ok=True)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        importer = Importer(upload_folder, photo_folder, executor)
+        batch = []
+        # The batch in flight when a previous run stopped may have been committed
+        skip_existing = done > 0
+
+        def flush():
+            nonlocal skip_existing
+            importer.import_batch(batch, skip_existing)
+            skip_existing = False
+            checkpoint.save(batch[-1][0])
+            elapsed = time.perf_counter() - start
+            print(f'{batch[-1][0]} records read, {importer.attractions} attractions and '
+                  f'{importer.photos} photos imported, {importer.skipped} skipped '
+                  f'({importer.attractions / elapsed:.0f} attractions/s)')
+            batch.clear()
+
+        for number, record in enumerate(read_records(path), start=1):
+            if number <= done:
+                continue
+            batch.append((number, record))
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+
+    checkpoint.clear()
+    return importer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='.csv or .jsonl file')
+    parser.add_argument('--photo-folder')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, help='Photo processing processes, defaults to the CPU count')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start from the first record')
+    args = parser.parse_args()
+
+    app = database.create_script_app()
+    with app.app_context():
+        database.tune(db.engine, app.config['SQLITE_PRAGMAS'])
+        db.create_all()
+        importer = run_import(args.input, app.config['UPLOAD_FOLDER'], args.photo_folder,
+                              args.batch_size, args.workers, args.restart)
+    print(f'Done: {importer.attractions} attractions, {importer.photos} photos, {importer.skipped} skipped')
+
+
+if __name__ == '__main__':
+    main()
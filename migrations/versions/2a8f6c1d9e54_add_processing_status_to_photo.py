@@ -0,0 +1,28 @@
+"""Add processing status to Photo
+
+Revision ID: 2a8f6c1d9e54
+Revises: e61f0b4c8a27
+Create Date: 2026-10-18 12:40:08.271935
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2a8f6c1d9e54'
+down_revision = 'e61f0b4c8a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('photo', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('status', sa.String(length=16), nullable=False, server_default='ready'))
+        batch_op.add_column(sa.Column('processing_error', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('photo', schema=None) as batch_op:
+        batch_op.drop_column('processing_error')
+        batch_op.drop_column('status')
@@ -0,0 +1,26 @@
+"""Add latitude/longitude index to Attraction
+
+Revision ID: 4b7e2d9a1f63
+Revises: c1300d3d401c
+Create Date: 2026-10-18 09:12:41.503118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7e2d9a1f63'
+down_revision = 'c1300d3d401c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('attraction', schema=None) as batch_op:
+        batch_op.create_index('ix_attraction_latitude_longitude', ['latitude', 'longitude'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('attraction', schema=None) as batch_op:
+        batch_op.drop_index('ix_attraction_latitude_longitude')
@@ -0,0 +1,32 @@
+"""Add running rating sum to Attraction
+
+Revision ID: 5e2b9d4c7a16
+Revises: 7c4e9b2f5a31
+Create Date: 2026-10-18 15:02:44.108392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2b9d4c7a16'
+down_revision = '7c4e9b2f5a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('attraction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('rating_sum', sa.Integer(), nullable=False, server_default='0'))
+
+    # Seed the sum from the existing average; `flask rebuild-stats` recomputes it exactly
+    op.execute(
+        'UPDATE attraction SET rating_sum = ROUND(COALESCE(average_rating, 0) * COALESCE(total_visits, 0)), '
+        'total_visits = COALESCE(total_visits, 0)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('attraction', schema=None) as batch_op:
+        batch_op.drop_column('rating_sum')
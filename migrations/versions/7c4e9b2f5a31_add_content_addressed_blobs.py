@@ -0,0 +1,50 @@
+"""Add content-addressed Blob table referenced by Photo
+
+Revision ID: 7c4e9b2f5a31
+Revises: 2a8f6c1d9e54
+Create Date: 2026-10-18 14:05:32.618904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c4e9b2f5a31'
+down_revision = '2a8f6c1d9e54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # app.py runs db.create_all() on import, which may have created the table already
+    if not sa.inspect(op.get_bind()).has_table('blob'):
+        _create_blob_table()
+
+    with op.batch_alter_table('photo', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('blob_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_photo_blob_id', 'blob', ['blob_id'], ['id'])
+
+
+def _create_blob_table():
+    op.create_table('blob',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('digest', sa.String(length=64), nullable=False),
+        sa.Column('variant', sa.String(length=16), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('renditions', sa.JSON(), nullable=True),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('processing_error', sa.String(length=255), nullable=True),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('digest', 'variant', name='uq_blob_digest_variant')
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('photo', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_photo_blob_id', type_='foreignkey')
+        batch_op.drop_column('blob_id')
+
+    op.drop_table('blob')
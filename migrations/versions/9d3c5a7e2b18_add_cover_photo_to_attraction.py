@@ -0,0 +1,34 @@
+"""Add cover photo reference to Attraction
+
+Revision ID: 9d3c5a7e2b18
+Revises: 4b7e2d9a1f63
+Create Date: 2026-10-18 10:02:17.884261
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3c5a7e2b18'
+down_revision = '4b7e2d9a1f63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('attraction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('cover_photo_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_attraction_cover_photo_id', 'photo', ['cover_photo_id'], ['id'])
+
+    # Backfill with each attraction's oldest photo
+    op.execute(
+        'UPDATE attraction SET cover_photo_id = '
+        '(SELECT MIN(photo.id) FROM photo WHERE photo.attraction_id = attraction.id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('attraction', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_attraction_cover_photo_id', type_='foreignkey')
+        batch_op.drop_column('cover_photo_id')
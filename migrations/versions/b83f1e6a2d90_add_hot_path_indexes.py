@@ -0,0 +1,36 @@
+"""Add indexes for attraction filters and photo feeds
+
+Revision ID: b83f1e6a2d90
+Revises: 5e2b9d4c7a16
+Create Date: 2026-10-18 15:47:19.630254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b83f1e6a2d90'
+down_revision = '5e2b9d4c7a16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('attraction', schema=None) as batch_op:
+        batch_op.create_index('ix_attraction_category_weather_suitability', ['category', 'weather_suitability'], unique=False)
+        batch_op.create_index('ix_attraction_weather_suitability', ['weather_suitability'], unique=False)
+
+    with op.batch_alter_table('photo', schema=None) as batch_op:
+        batch_op.create_index('ix_photo_attraction_id_upload_date', ['attraction_id', 'upload_date'], unique=False)
+        batch_op.create_index('ix_photo_user_id_upload_date', ['user_id', 'upload_date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('photo', schema=None) as batch_op:
+        batch_op.drop_index('ix_photo_user_id_upload_date')
+        batch_op.drop_index('ix_photo_attraction_id_upload_date')
+
+    with op.batch_alter_table('attraction', schema=None) as batch_op:
+        batch_op.drop_index('ix_attraction_weather_suitability')
+        batch_op.drop_index('ix_attraction_category_weather_suitability')
@@ -0,0 +1,59 @@
+"""Add FTS5 full-text index over attraction names and descriptions
+
+Revision ID: d4a7c2e9f815
+Revises: b83f1e6a2d90
+Create Date: 2026-10-18 16:31:05.842177
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a7c2e9f815'
+down_revision = 'b83f1e6a2d90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    # IF NOT EXISTS: app.py creates the index on startup when it is missing
+    op.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS attraction_fts USING fts5(
+            name, description,
+            content='attraction', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    op.execute("""
+        CREATE TRIGGER IF NOT EXISTS attraction_fts_insert AFTER INSERT ON attraction BEGIN
+            INSERT INTO attraction_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER IF NOT EXISTS attraction_fts_delete AFTER DELETE ON attraction BEGIN
+            INSERT INTO attraction_fts(attraction_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER IF NOT EXISTS attraction_fts_update AFTER UPDATE OF name, description ON attraction BEGIN
+            INSERT INTO attraction_fts(attraction_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO attraction_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    """)
+    op.execute("INSERT INTO attraction_fts(attraction_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute('DROP TRIGGER IF EXISTS attraction_fts_update')
+    op.execute('DROP TRIGGER IF EXISTS attraction_fts_delete')
+    op.execute('DROP TRIGGER IF EXISTS attraction_fts_insert')
+    op.execute('DROP TABLE IF EXISTS attraction_fts')
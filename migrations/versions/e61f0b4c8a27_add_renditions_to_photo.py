@@ -0,0 +1,26 @@
+"""Add renditions to Photo
+
+Revision ID: e61f0b4c8a27
+Revises: 9d3c5a7e2b18
+Create Date: 2026-10-18 11:26:53.190442
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e61f0b4c8a27'
+down_revision = '9d3c5a7e2b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('photo', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('renditions', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('photo', schema=None) as batch_op:
+        batch_op.drop_column('renditions')
@@ -30,13 +30,29 @@ class Attraction(db.Model):
     longitude = db.Column(db.Float, nullable=False)
     category = db.Column(db.Enum(AttractionCategory), nullable=False)
     weather_suitability = db.Column(db.Enum(WeatherSuitability), nullable=False)
+    # Running aggregates over rated visits, maintained by attraction_stats
     average_rating = db.Column(db.Float, default=0)
     total_visits = db.Column(db.Integer, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     barcode = db.Column(db.String(100), unique=True)
+    cover_photo_id = db.Column(
+        db.Integer,
+        db.ForeignKey('photo.id', use_alter=True, name='fk_attraction_cover_photo_id'),
+        nullable=True
+    )
 
-    photos = db.relationship('Photo', backref='attraction', lazy=True)
+    photos = db.relationship('Photo', backref='attraction', lazy=True, foreign_keys='Photo.attraction_id')
+    # Denormalized header image so pages don't need to load the photo list
+    cover_photo = db.relationship('Photo', foreign_keys=[cover_photo_id], post_update=True)
     reviews = db.relationship('Review', backref='attraction', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_attraction_latitude_longitude', 'latitude', 'longitude'),
+        # Listing filters: category alone or with weather, and weather alone
+        db.Index('ix_attraction_category_weather_suitability', 'category', 'weather_suitability'),
+        db.Index('ix_attraction_weather_suitability', 'weather_suitability'),
+    )
+
 class Photo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
@@ -45,6 +61,41 @@ class Photo(db.Model):
     attraction_id = db.Column(db.Integer, db.ForeignKey('attraction.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     rating = db.Column(db.Integer, nullable=False, default=5)
+    # Rendition name -> {'width', 'height', 'jpeg', 'webp'}, see photo_processor
+    renditions = db.Column(db.JSON, nullable=True)
+    # 'pending' while image_queue processes the upload, then 'ready' or 'failed'
+    status = db.Column(db.String(16), nullable=False, default='ready', server_default='ready')
+    processing_error = db.Column(db.String(255), nullable=True)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.id'), nullable=True)
+
+    blob = db.relationship('Blob', backref='photos')
+
+    __table_args__ = (
+        # Photo feed of an attraction and a user's profile, both newest first
+        db.Index('ix_photo_attraction_id_upload_date', 'attraction_id', 'upload_date'),
+        db.Index('ix_photo_user_id_upload_date', 'user_id', 'upload_date'),
+    )
+
+class Blob(db.Model):
+    """
+    Content-addressed upload shared by every Photo with identical bytes.
+
+    Keyed by the SHA-256 of the uploaded bytes and the rendition variant
+    (full-size target, e.g. '1200x800'); ref_count tracks the photos using it.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    digest = db.Column(db.String(64), nullable=False)
+    variant = db.Column(db.String(16), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    renditions = db.Column(db.JSON, nullable=True)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    processing_error = db.Column(db.String(255), nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('digest', 'variant', name='uq_blob_digest_variant'),
+    )
 
     # No need for explicit relationship mappings here as they are defined in Attraction and User models
 
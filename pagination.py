@@ -0,0 +1,55 @@
+import base64
+import json
+import math
+
+# Type of a cursor value that may be an int or a float, e.g. a distance
+NUMBER = (int, float)
+
+
+def encode_cursor(*values):
+    """
+    Encode the sort key of the last item on a page as an opaque URL-safe token.
+
+    Args:
+    - values: JSON-serializable sort key values, e.g. (distance, id)
+
+    Returns:
+    - Cursor string for the next page
+    """
+    payload = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def _valid(value, expected):
+    # bool is an int subclass, and NaN or infinity would break the ordering
+    if isinstance(value, bool) or not isinstance(value, expected):
+        return False
+    return not isinstance(value, float) or math.isfinite(value)
+
+
+def decode_cursor(token, size, types=None):
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Args:
+    - token: Cursor string from the request
+    - size: Number of values the cursor must contain
+    - types: Optional expected type of each value, e.g. (NUMBER, int)
+
+    Returns:
+    - Tuple of the sort key values
+
+    Raises:
+    - ValueError if the token is malformed
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f'Invalid cursor: {token!r}') from e
+
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError(f'Invalid cursor: {token!r}')
+    if types is not None and not all(_valid(value, expected) for value, expected in zip(values, types)):
+        raise ValueError(f'Invalid cursor: {token!r}')
+    return tuple(values)
@@ -1,44 +1,170 @@
 from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
 import os
 from werkzeug.utils import secure_filename
 import uuid
 
-def process_and_save_image(photo, upload_folder, target_size=(800, 600), quality=85):
+# Widths of the smaller renditions; 'full' is always the requested target size
+RENDITION_WIDTHS = {
+    'thumb': 400,
+    'card': 800,
+}
+
+# Output formats written for every rendition: name -> (Pillow format, extension, save options)
+RENDITION_FORMATS = {
+    'jpeg': ('JPEG', '.jpg', {'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', '.webp', {'method': 4}),
+}
+
+# Large images are cheaply pre-shrunk to this multiple of their final size
+# before the high-quality LANCZOS pass
+REDUCING_GAP = 2.0
+
+def _open_rgb(photo, fit_size=None):
     """
-    Process and save an uploaded image with consistent sizing
-    
-    Args:
-    - photo: FileStorage object from Flask
-    - upload_folder: Directory to save processed images
-    - target_size: Tuple of (width, height) to resize images
-    - quality: JPEG compression quality (1-95)
-    
-    Returns:
-    - filename of processed image
+    Decode an uploaded image and convert it to RGB
+
+    With fit_size, big images are downscaled while decoding: JPEGs use DCT
+    scaling (draft mode) and anything still much larger gets an integer
+    reduce(). Both stop at REDUCING_GAP times the size the image will have
+    once fitted into fit_size, so the final resize quality is unchanged.
     """
-    # Open the image
     img = Image.open(photo)
-    
+
+    scale = None
+    if fit_size:
+        # Scale at which the image fits inside fit_size
+        scale = min(fit_size[0] / img.width, fit_size[1] / img.height)
+        if img.format == 'JPEG':
+            img.draft(None, (max(1, int(img.width * scale * REDUCING_GAP)),
+                             max(1, int(img.height * scale * REDUCING_GAP))))
+            # draft() changes the decoded size; keep the fit scale relative to it
+            scale = min(fit_size[0] / img.width, fit_size[1] / img.height)
+
     # Convert to RGB mode to handle various image formats
     if img.mode != 'RGB':
         img = img.convert('RGB')
-    
+
+    if scale:
+        factor = int(1 / (scale * REDUCING_GAP))
+        if factor >= 2:
+            img = img.reduce(factor)
+    return img
+
+def _letterbox(img, target_size):
+    """Resize to fit target_size in place, padding with a white background to the exact size"""
     # Resize image while maintaining aspect ratio
     img.thumbnail(target_size, Image.LANCZOS)
-    
+
     # Create a new image with solid background if needed
     if img.size != target_size:
         background = Image.new('RGB', target_size, (255, 255, 255))  # White background
-        offset = ((target_size[0] - img.size[0]) // 2, 
+        offset = ((target_size[0] - img.size[0]) // 2,
                   (target_size[1] - img.size[1]) // 2)
         background.paste(img, offset)
         img = background
-    
-    # Generate a unique filename
-    filename = secure_filename(f"{uuid.uuid4()}_{photo.filename}")
-    filepath = os.path.join(upload_folder, filename)
-    
-    # Save the processed image
-    img.save(filepath, 'JPEG', quality=quality, optimize=True)
-    
-    return filename
\ No newline at end of file
+    return img
+
+def rendition_sizes(target_size):
+    """
+    Sizes of the renditions produced for a given full-size target.
+
+    Smaller renditions keep the aspect ratio of target_size so they can be
+    used interchangeably in a srcset. Renditions wider than the target are
+    skipped.
+
+    Returns:
+    - Dict of rendition name -> (width, height), smallest first
+    """
+    width, height = target_size
+    sizes = {}
+    for name, rendition_width in sorted(RENDITION_WIDTHS.items(), key=lambda item: item[1]):
+        if rendition_width < width:
+            sizes[name] = (rendition_width, round(height * rendition_width / width))
+    sizes['full'] = target_size
+    return sizes
+
+def process_and_save_renditions(photo, upload_folder, target_size=(800, 600), quality=85, filename=None,
+                                fast=True, stem=None):
+    """
+    Process an uploaded image into a set of renditions from a single decode
+
+    Every rendition (thumbnail, card and full size) is written as both JPEG
+    and WebP so clients can pick the smallest adequate file.
+
+    Args:
+    - photo: FileStorage object from Flask, or path of a raw upload
+    - upload_folder: Directory to save processed images
+    - target_size: Tuple of (width, height) of the full-size rendition
+    - quality: JPEG/WebP compression quality (1-95)
+    - filename: Original filename used to name the output; defaults to photo.filename
+    - fast: Downscale large images while decoding (see _open_rgb)
+    - stem: Exact base name for the output files; defaults to a unique name
+      derived from filename
+
+    Returns:
+    - Dict of rendition name -> {'width', 'height', 'jpeg', 'webp'} where the
+      format keys hold filenames. renditions['full']['jpeg'] is the main file.
+    """
+    img = _open_rgb(photo, fit_size=target_size if fast else None)
+
+    if stem is None:
+        filename = filename or photo.filename
+        stem = os.path.splitext(secure_filename(f"{uuid.uuid4()}_{filename}"))[0]
+    renditions = {}
+
+    # Work from the largest rendition down so each resize starts from the
+    # previous, already smaller one; they all share the same aspect ratio
+    source = img
+    for name, size in sorted(rendition_sizes(target_size).items(), key=lambda item: -item[1][0]):
+        rendered = _letterbox(source.copy(), size)
+        entry = {'width': size[0], 'height': size[1]}
+        for fmt, (pil_format, ext, options) in RENDITION_FORMATS.items():
+            output = f"{stem}_{name}{ext}" if name != 'full' else f"{stem}{ext}"
+            rendered.save(os.path.join(upload_folder, output), pil_format, quality=quality, **options)
+            entry[fmt] = output
+        renditions[name] = entry
+        source = rendered
+
+    return renditions
+
+def process_batch(paths, upload_folder, target_size=(800, 600), quality=85, executor=None, stems=None):
+    """
+    Produce renditions for several raw uploads in parallel
+
+    Pillow's resize and encode are CPU-bound, so the images are spread
+    across a process pool rather than threads.
+
+    Args:
+    - paths: Paths of raw uploads
+    - upload_folder: Directory to save processed images
+    - target_size: Tuple of (width, height) of the full-size rendition
+    - quality: JPEG/WebP compression quality (1-95)
+    - executor: ProcessPoolExecutor to use; a temporary one is created if omitted
+    - stems: Output base names, one per path; unique names are generated if omitted
+
+    Returns:
+    - List in the order of paths, holding each image's renditions dict or
+      the exception raised while processing it
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=min(len(paths), os.cpu_count() or 1) or 1)
+
+    stems = stems or [None] * len(paths)
+    try:
+        futures = [
+            executor.submit(process_and_save_renditions, path, upload_folder,
+                            target_size, quality, os.path.basename(path), True, stem)
+            for path, stem in zip(paths, stems)
+        ]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+    finally:
+        if own_executor:
+            executor.shutdown()
@@ -40,6 +40,7 @@ def add_photos_to_attraction(attraction, user, photo_folder):
                 user_id=1234
             )
             db.session.add(photo)
+            attraction.cover_photo = photo
             break  # Stop after finding the first matching photo
     
     return None
@@ -0,0 +1,58 @@
+from flask_login import UserMixin
+
+
+class Principal(UserMixin):
+    """
+    Read-only snapshot of a user, safe to cache across requests.
+
+    Unlike a User row it is not bound to a database session and holds no
+    password hash. Code that needs the full row loads it by id.
+    """
+
+    def __init__(self, id=None, username=None, email=None, is_admin=False, profile_photo=None):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.is_admin = bool(is_admin)
+        self.profile_photo = profile_photo
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email, user.is_admin, user.profile_photo)
+
+    @property
+    def is_authenticated(self):
+        return self.id is not None
+
+    @property
+    def is_anonymous(self):
+        return self.id is None
+
+    def to_session(self, version):
+        """
+        The fields routes check for permissions, to embed in the session cookie.
+
+        Args:
+        - version: Stamp of the user when the snapshot was taken, see from_session()
+        """
+        return {'id': self.id, 'is_admin': self.is_admin, 'version': version}
+
+    @classmethod
+    def from_session(cls, data, version):
+        """
+        Rebuild a principal embedded with to_session().
+
+        Args:
+        - data: Value stored in the session
+        - version: The user's current stamp; an embedded principal older than
+          it is stale
+
+        Returns:
+        - Principal with only id and is_admin set, or None if data is missing or stale
+        """
+        if not data or data.get('version', 0) < version:
+            return None
+        return cls(data['id'], is_admin=data['is_admin'])
+
+
+ANONYMOUS = Principal()
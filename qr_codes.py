@@ -0,0 +1,195 @@
+import glob
+import hashlib
+import io
+import os
+import tempfile
+
+import numpy as np
+import qrcode
+from PIL import Image
+
+from cache import TaggedCache
+
+# Output format -> MIME type
+FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+# Subfolder of the upload folder holding cached QR codes
+CACHE_FOLDER = 'qr'
+
+# Pixels per module and quiet-zone width in modules
+BOX_SIZE = 10
+BORDER = 5
+
+
+def attraction_payload(name, description):
+    """Text encoded in an attraction's QR code"""
+    return f"Attraction: {name}\nDescription: {description}"
+
+
+def content_hash(payload, fmt):
+    """
+    Hash identifying the rendered image, usable as its ETag.
+
+    It depends only on what is drawn, so it can be computed without
+    rendering and changes whenever the payload does.
+    """
+    key = f'{fmt}:{BOX_SIZE}:{BORDER}\n{payload}'.encode('utf-8')
+    return hashlib.sha256(key).hexdigest()[:20]
+
+
+def _make_qr(payload):
+    qr = qrcode.QRCode(version=1, box_size=BOX_SIZE, border=BORDER)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr
+
+
+def render_image(payload, box_size=BOX_SIZE, border=BORDER, max_size=None, mask_pattern=None,
+                 error_correction=qrcode.constants.ERROR_CORRECT_M):
+    """
+    Render a QR code straight at its final resolution as a 1-bit image.
+
+    Every module is scaled up by an integer box_size, so edges stay sharp
+    and no resampling is needed.
+
+    Args:
+    - payload: Text to encode
+    - box_size: Pixels per module
+    - border: Quiet-zone width in modules
+    - max_size: If given, use the largest box_size that fits this many pixels
+    - mask_pattern: Fixed mask (0-7). Skips scoring all eight masks, which is
+      most of the encoding time, at the cost of a possibly less even pattern
+    - error_correction: One of the qrcode.constants.ERROR_CORRECT_* levels
+
+    Returns:
+    - PIL image in mode '1'
+    """
+    qr = qrcode.QRCode(version=1, error_correction=error_correction, box_size=box_size, border=border,
+                       mask_pattern=mask_pattern)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    # Dark modules are True; in mode '1' black is 0
+    light = ~np.array(qr.get_matrix(), dtype=bool)
+    if max_size:
+        box_size = max(1, max_size // len(light))
+    return Image.fromarray(light.repeat(box_size, axis=0).repeat(box_size, axis=1))
+
+
+def render_png(payload):
+    """Render a QR code as PNG bytes"""
+    buffer = io.BytesIO()
+    render_image(payload).save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def render_svg(payload):
+    """
+    Render a QR code as a compact SVG.
+
+    Each horizontal run of dark modules becomes one rectangle of a single
+    path, in module units, so the file stays small and scales to any print
+    size.
+    """
+    matrix = _make_qr(payload).get_matrix()
+    commands = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < len(row):
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < len(row) and row[x]:
+                x += 1
+            commands.append(f'M{start} {y}h{x - start}v1h-{x - start}z')
+
+    size = len(matrix)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" '
+        f'width="{size * BOX_SIZE}" height="{size * BOX_SIZE}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path d="{"".join(commands)}"/></svg>'
+    ).encode('utf-8')
+
+
+RENDERERS = {
+    'png': render_png,
+    'svg': render_svg,
+}
+
+
+def cache_filename(attraction_id, payload, fmt):
+    """Name of an attraction's cached QR code file, relative to the cache folder"""
+    return f'{attraction_id}_{content_hash(payload, fmt)}.{fmt}'
+
+
+class QRCodeCache:
+    """
+    Two-level cache of rendered attraction QR codes.
+
+    Images are kept in a bounded in-memory LRU and on disk as
+    `<attraction_id>_<content hash>.<format>`. The hash covers the payload,
+    so renaming an attraction or editing its description misses both
+    levels; the attraction's outdated files are deleted when the new one
+    is written.
+    """
+
+    def __init__(self, folder, max_entries=256):
+        self.folder = folder
+        self._memory = TaggedCache(max_entries=max_entries, ttl=float('inf'))
+
+    def filename(self, attraction_id, payload, fmt):
+        """Name of the cached file, relative to the cache folder"""
+        return cache_filename(attraction_id, payload, fmt)
+
+    def get(self, attraction_id, payload, fmt='png'):
+        """
+        Return an attraction's QR code, rendering it only on a cache miss.
+
+        Args:
+        - attraction_id: Attraction the code belongs to
+        - payload: Text to encode, see attraction_payload()
+        - fmt: Key of FORMATS
+
+        Returns:
+        - Image bytes
+        """
+        filename = self.filename(attraction_id, payload, fmt)
+        data = self._memory.get(filename)
+        if data is not None:
+            return data
+
+        path = os.path.join(self.folder, filename)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = RENDERERS[fmt](payload)
+            self._write(attraction_id, path, data)
+
+        self._memory.set(filename, data)
+        return data
+
+    def path(self, attraction_id, payload, fmt='png'):
+        """Path of the cached file, rendering it first if needed"""
+        self.get(attraction_id, payload, fmt)
+        return os.path.join(self.folder, self.filename(attraction_id, payload, fmt))
+
+    def _write(self, attraction_id, path, data):
+        os.makedirs(self.folder, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.part')
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data)
+        os.replace(temp_path, path)
+
+        # Drop files rendered from an older name or description
+        ext = os.path.splitext(path)[1]
+        for old in glob.glob(os.path.join(self.folder, f'{attraction_id}_*{ext}')):
+            if old != path:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
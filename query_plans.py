@@ -0,0 +1,84 @@
+import re
+
+from sqlalchemy import text
+
+from models import db, Attraction, Photo, AttractionCategory, WeatherSuitability
+
+# "SCAN photo" or "SCAN photo USING INDEX ..." both read the whole table or index
+FULL_SCAN = re.compile(r'^SCAN (\w+)')
+TEMP_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+def hot_queries():
+    """
+    The queries behind the busiest routes, built the same way the routes build them.
+
+    Returns:
+    - List of (name, query, ordered) tuples; ordered queries must be served
+      in index order without a separate sort step
+    """
+    category = next(iter(AttractionCategory)).name
+    weather = next(iter(WeatherSuitability)).name
+    ranking_columns = (Attraction.id, Attraction.latitude, Attraction.longitude)
+
+    return [
+        ('list_attractions?category',
+         Attraction.query.filter(Attraction.category == category).with_entities(*ranking_columns),
+         False),
+        ('list_attractions?category&weather',
+         Attraction.query.filter(Attraction.category == category,
+                                 Attraction.weather_suitability == weather).with_entities(*ranking_columns),
+         False),
+        ('list_attractions?weather',
+         Attraction.query.filter(Attraction.weather_suitability == weather).with_entities(*ranking_columns),
+         False),
+        ('attraction_photos',
+         Photo.query.filter(Photo.attraction_id == 1, Photo.status == 'ready')
+         .order_by(Photo.upload_date.desc(), Photo.id.desc()).limit(11),
+         True),
+        ('profile',
+         Photo.query.filter_by(user_id=1234).order_by(Photo.upload_date.desc()),
+         True),
+    ]
+
+
+def explain(query):
+    """
+    Run EXPLAIN QUERY PLAN for a query on SQLite.
+
+    Returns:
+    - List of plan detail lines, e.g. 'SEARCH photo USING INDEX ...'
+    """
+    statement = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+    return [row.detail for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {statement}'))]
+
+
+def plan_problems(details, ordered=False):
+    """
+    Problems found in a query plan.
+
+    Args:
+    - details: Plan detail lines from explain()
+    - ordered: Also report a temporary sort for ORDER BY
+
+    Returns:
+    - List of offending plan lines, empty if the plan is fine
+    """
+    problems = [detail for detail in details if FULL_SCAN.match(detail)]
+    if ordered:
+        problems += [detail for detail in details if detail.startswith(TEMP_SORT)]
+    return problems
+
+
+def check():
+    """
+    Explain every hot query and collect the ones that fall back to a scan.
+
+    Returns:
+    - List of (name, plan details, problems) tuples, one per query
+    """
+    results = []
+    for name, query, ordered in hot_queries():
+        details = explain(query)
+        results.append((name, details, plan_problems(details, ordered)))
+    return results
@@ -0,0 +1,129 @@
+import numpy as np
+from geopy.distance import geodesic
+
+# Mean Earth radius (IUGG) in kilometers
+EARTH_RADIUS_KM = 6371.0088
+
+# Palm Coast center, used when the request carries no location
+DEFAULT_LOCATION = (29.616395, -81.202324)
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """
+    Great-circle distance from one point to many points in a single batched call.
+
+    Args:
+    - latitude, longitude: Origin point in degrees
+    - latitudes, longitudes: NumPy arrays of destination points in degrees
+
+    Returns:
+    - NumPy array of distances in kilometers, rounded to the millimeter so the
+      same point always gets the same distance regardless of batch layout
+    """
+    lat1 = np.radians(latitude)
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlon = np.radians(longitudes) - np.radians(longitude)
+
+    a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2.0) ** 2
+    distances = 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    return np.round(distances, 6)
+
+
+class RankingEngine:
+    """
+    Distance ranking over a set of attractions.
+
+    Coordinates are kept in contiguous float64 arrays so that distances to every
+    attraction are computed in one vectorized haversine call instead of one
+    geodesic() solve per row.
+
+    Items at the same distance are ordered by their key (the item's position
+    when no keys are given), so (distance, key) pairs can be used as a
+    pagination cursor.
+    """
+
+    def __init__(self, items, latitudes, longitudes, keys=None):
+        self.items = list(items)
+        self.latitudes = np.ascontiguousarray(latitudes, dtype=np.float64)
+        self.longitudes = np.ascontiguousarray(longitudes, dtype=np.float64)
+        if keys is None:
+            keys = np.arange(len(self.items))
+        self.keys = np.ascontiguousarray(keys, dtype=np.int64)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build an engine over ids from (id, latitude, longitude) rows"""
+        ids, latitudes, longitudes = [], [], []
+        for row_id, latitude, longitude in rows:
+            ids.append(row_id)
+            latitudes.append(latitude)
+            longitudes.append(longitude)
+        return cls(ids, latitudes, longitudes, keys=ids)
+
+    @classmethod
+    def from_attractions(cls, attractions):
+        """Build an engine from Attraction objects (or anything with latitude/longitude)"""
+        attractions = list(attractions)
+        count = len(attractions)
+        latitudes = np.fromiter((a.latitude for a in attractions), dtype=np.float64, count=count)
+        longitudes = np.fromiter((a.longitude for a in attractions), dtype=np.float64, count=count)
+        return cls(attractions, latitudes, longitudes)
+
+    def __len__(self):
+        return len(self.items)
+
+    def distances(self, user_location):
+        """Haversine distance in kilometers from user_location to every item"""
+        return haversine_km(user_location[0], user_location[1], self.latitudes, self.longitudes)
+
+    def rank(self, user_location, limit=None, exact=False, radius_km=None, after=None):
+        """
+        Rank items from closest to farthest.
+
+        Args:
+        - user_location: Tuple of (latitude, longitude)
+        - limit: Only return the closest `limit` items; uses partial selection
+          instead of a full sort
+        - exact: Re-rank the returned items using the ellipsoidal geodesic
+          distance. Only the selected items pay for the exact solve.
+        - radius_km: Drop items farther than this many kilometers
+        - after: (distance_km, key) cursor; only items ranked after it are
+          returned
+
+        Returns:
+        - List of (item, distance_km) tuples
+        """
+        if not self.items:
+            return []
+
+        distances = self.distances(user_location)
+        mask = np.ones(len(distances), dtype=bool)
+        if radius_km is not None:
+            mask &= distances <= radius_km
+        if after is not None:
+            after_distance, after_key = after
+            mask &= (distances > after_distance) | ((distances == after_distance) & (self.keys > after_key))
+        candidates = np.flatnonzero(mask)
+        count = len(candidates)
+
+        if limit is not None and limit < count:
+            if limit <= 0:
+                return []
+            # Partial selection, keeping every item tied with the cutoff distance
+            cutoff = np.partition(distances[candidates], limit - 1)[limit - 1]
+            candidates = candidates[distances[candidates] <= cutoff]
+        order = candidates[np.lexsort((self.keys[candidates], distances[candidates]))]
+        if limit is not None:
+            order = order[:limit]
+
+        ranked = [(self.items[i], float(distances[i])) for i in order]
+
+        if exact:
+            ranked = [
+                (item, geodesic(user_location, (self.latitudes[i], self.longitudes[i])).kilometers)
+                for (item, _), i in zip(ranked, order)
+            ]
+            ranked.sort(key=lambda pair: pair[1])
+
+        return ranked
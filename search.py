@@ -0,0 +1,147 @@
+import re
+
+from sqlalchemy import column, literal_column, table, text
+
+from models import db, Attraction
+
+# External-content FTS5 index over attraction names and descriptions, kept
+# in sync with the attraction table by triggers. The prefix indexes make
+# "word*" queries as cheap as whole words.
+FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS attraction_fts USING fts5(
+        name, description,
+        content='attraction', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS attraction_fts_insert AFTER INSERT ON attraction BEGIN
+        INSERT INTO attraction_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS attraction_fts_delete AFTER DELETE ON attraction BEGIN
+        INSERT INTO attraction_fts(attraction_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS attraction_fts_update AFTER UPDATE OF name, description ON attraction BEGIN
+        INSERT INTO attraction_fts(attraction_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO attraction_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+# Column weights for bm25(): a hit in the name counts for more than one in the description
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+attraction_fts = table('attraction_fts', column('rowid'))
+
+
+def fts_supported(engine):
+    return engine.dialect.name == 'sqlite'
+
+
+def ensure_index(engine):
+    """
+    Create the FTS5 table and its triggers if they are missing, filling the index from existing rows.
+
+    Does nothing on databases other than SQLite.
+    """
+    if not fts_supported(engine):
+        return
+    with engine.begin() as connection:
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attraction_fts'")
+        ).first()
+        for statement in FTS_DDL:
+            connection.execute(text(statement))
+        if not exists:
+            connection.execute(text("INSERT INTO attraction_fts(attraction_fts) VALUES ('rebuild')"))
+
+
+def to_fts_query(query):
+    """
+    Turn free text into an FTS5 query that matches every word as a prefix.
+
+    Words are quoted, so FTS5 operators and punctuation in user input are
+    treated as plain text.
+
+    Returns:
+    - FTS5 query string, or None if the text has no words
+    """
+    tokens = TOKEN.findall(query)
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search(query, limit=500, filters=()):
+    """
+    Attractions matching a free-text query, best first.
+
+    Args:
+    - query: Free text typed by the user
+    - limit: Maximum number of matches
+    - filters: SQL conditions on Attraction columns a match must also meet,
+      applied before the limit
+
+    Returns:
+    - Dict of attraction id -> relevance (higher is better)
+    """
+    fts_query = to_fts_query(query)
+    if fts_query is None:
+        return {}
+
+    if not fts_supported(db.engine):
+        # No FTS index elsewhere; every substring match is equally relevant
+        pattern = f'%{query.strip()}%'
+        ids = db.session.scalars(
+            db.select(Attraction.id)
+            .where(db.or_(Attraction.name.ilike(pattern), Attraction.description.ilike(pattern)), *filters)
+            .limit(limit)
+        )
+        return {attraction_id: 1.0 for attraction_id in ids}
+
+    # The virtual table's name stands for the whole row in MATCH and bm25()
+    fts_row = literal_column('attraction_fts')
+    score = db.func.bm25(fts_row, NAME_WEIGHT, DESCRIPTION_WEIGHT).label('score')
+    statement = (
+        db.select(attraction_fts.c.rowid, score)
+        .join(Attraction, Attraction.id == attraction_fts.c.rowid)
+        .where(fts_row.match(fts_query), *filters)
+        .order_by(score)
+        .limit(limit)
+    )
+    # bm25() is negative, lower meaning more relevant
+    return {row.rowid: -row.score for row in db.session.execute(statement)}
+
+
+def blend(ranked, relevance, distance_scale_km=25.0):
+    """
+    Order search matches by text relevance discounted by distance.
+
+    A match distance_scale_km away keeps half its relevance. Floats survive
+    the JSON round trip exactly, so (score, id) works as a pagination cursor.
+
+    Args:
+    - ranked: List of (attraction id, distance_km) from RankingEngine.rank
+    - relevance: Dict of attraction id -> relevance from search()
+    - distance_scale_km: Distance at which relevance is halved
+
+    Returns:
+    - List of (attraction id, score) tuples, best first
+    """
+    scored = [
+        (attraction_id, relevance[attraction_id] / (1 + distance / distance_scale_km))
+        for attraction_id, distance in ranked
+        if attraction_id in relevance
+    ]
+    scored.sort(key=lambda hit: (-hit[1], hit[0]))
+    return scored
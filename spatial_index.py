@@ -0,0 +1,210 @@
+import math
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from ranking import EARTH_RADIUS_KM, haversine_km
+
+# Length of one degree of latitude in kilometers
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+# Half the Earth's circumference; no two points are farther apart than this
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+
+
+def bounding_box(location, radius_km):
+    """
+    Latitude/longitude box that contains every point within radius_km of location.
+
+    Args:
+    - location: Tuple of (latitude, longitude)
+    - radius_km: Search radius in kilometers
+
+    Returns:
+    - Tuple of (min_lat, max_lat, min_lon, max_lon). min_lon is greater than
+      max_lon when the box crosses the antimeridian. The longitude range is the
+      full [-180, 180] when the box reaches a pole.
+    """
+    latitude, longitude = location
+    delta_lat = radius_km / KM_PER_DEGREE
+    min_lat = latitude - delta_lat
+    max_lat = latitude + delta_lat
+
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+
+    # Widest longitude span is at the latitude closest to a pole
+    widest = max(abs(min_lat), abs(max_lat))
+    delta_lon = delta_lat / math.cos(math.radians(widest))
+    if delta_lon >= 180:
+        return min_lat, max_lat, -180.0, 180.0
+
+    min_lon = longitude - delta_lon
+    max_lon = longitude + delta_lon
+    if min_lon < -180:
+        min_lon += 360
+    if max_lon > 180:
+        max_lon -= 360
+    return min_lat, max_lat, min_lon, max_lon
+
+
+class SpatialIndex:
+    """
+    Fixed-size latitude/longitude grid over point locations.
+
+    Points are bucketed into square cells of `cell_size` degrees, so radius and
+    nearest-N queries only look at the cells overlapping the search area
+    instead of every point. Points can be added, moved and removed one at a
+    time, which keeps the index current as attractions are created.
+    """
+
+    def __init__(self, cell_size=0.25):
+        self.cell_size = cell_size
+        self._columns = int(math.ceil(360 / cell_size))
+        self._cells = defaultdict(dict)
+        self._points = {}
+        self._lock = threading.RLock()
+        self.built = False
+        # Set by rebuild(), so callers can tell when the contents are out of date
+        self.version = None
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def _cell(self, latitude, longitude):
+        row = int(math.floor((latitude + 90) / self.cell_size))
+        column = int(math.floor((longitude + 180) / self.cell_size)) % self._columns
+        return row, column
+
+    def add(self, key, latitude, longitude, tags=None):
+        """Insert a point, or move it if `key` is already indexed"""
+        with self._lock:
+            self._discard(key)
+            cell = self._cell(latitude, longitude)
+            self._cells[cell][key] = (latitude, longitude, tags or {})
+            self._points[key] = cell
+
+    def remove(self, key):
+        """Remove a point; unknown keys are ignored"""
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        cell = self._points.pop(key, None)
+        if cell is not None:
+            bucket = self._cells[cell]
+            bucket.pop(key, None)
+            if not bucket:
+                del self._cells[cell]
+
+    def rebuild(self, rows, version=None):
+        """
+        Replace the index contents.
+
+        Args:
+        - rows: Iterable of (key, latitude, longitude, tags) tuples
+        - version: Stamp of the data the rows were read from, kept in `version`
+        """
+        with self._lock:
+            self._cells.clear()
+            self._points.clear()
+            for key, latitude, longitude, tags in rows:
+                cell = self._cell(latitude, longitude)
+                self._cells[cell][key] = (latitude, longitude, tags or {})
+                self._points[key] = cell
+            self.built = True
+            self.version = version
+            self.built_at = time.monotonic()
+
+    def _candidate_cells(self, location, radius_km):
+        min_lat, max_lat, min_lon, max_lon = bounding_box(location, radius_km)
+        first_row = self._cell(min_lat, 0)[0]
+        last_row = self._cell(max_lat, 0)[0]
+
+        if min_lon == -180.0 and max_lon == 180.0:
+            columns = range(self._columns)
+        else:
+            first_column = self._cell(0, min_lon)[1]
+            last_column = self._cell(0, max_lon)[1]
+            if first_column <= last_column:
+                columns = range(first_column, last_column + 1)
+            else:
+                # Box crosses the antimeridian
+                columns = list(range(first_column, self._columns)) + list(range(0, last_column + 1))
+
+        # Walking the occupied cells is cheaper than probing a huge empty box
+        if (last_row - first_row + 1) * len(columns) > len(self._cells):
+            column_set = set(columns)
+            return [
+                cell for cell in self._cells
+                if first_row <= cell[0] <= last_row and cell[1] in column_set
+            ]
+        return [
+            (row, column)
+            for row in range(first_row, last_row + 1)
+            for column in columns
+            if (row, column) in self._cells
+        ]
+
+    def within(self, location, radius_km, predicate=None):
+        """
+        Points within radius_km of location.
+
+        Args:
+        - location: Tuple of (latitude, longitude)
+        - radius_km: Search radius in kilometers
+        - predicate: Optional callable taking a point's tags; points for
+          which it returns False are skipped
+
+        Returns:
+        - List of (key, distance_km) tuples, closest first
+        """
+        with self._lock:
+            keys, latitudes, longitudes = [], [], []
+            for cell in self._candidate_cells(location, radius_km):
+                for key, (latitude, longitude, tags) in self._cells[cell].items():
+                    if predicate is None or predicate(tags):
+                        keys.append(key)
+                        latitudes.append(latitude)
+                        longitudes.append(longitude)
+
+        if not keys:
+            return []
+
+        distances = haversine_km(location[0], location[1], np.array(latitudes), np.array(longitudes))
+        inside = np.flatnonzero(distances <= radius_km)
+        order = inside[np.argsort(distances[inside], kind='stable')]
+        return [(keys[i], float(distances[i])) for i in order]
+
+    def nearest(self, location, count, predicate=None, after=None):
+        """
+        The `count` points closest to location.
+
+        The search radius starts one cell beyond the cursor (or at one cell)
+        and doubles until enough points are found, so only the neighbourhood
+        of location, or of the previous page, is examined.
+
+        Args:
+        - after: (distance_km, key) cursor; only points ranked after it are returned
+
+        Returns:
+        - List of (key, distance_km) tuples, by distance then key
+        """
+        if count <= 0:
+            return []
+
+        radius_km = min(self.cell_size * KM_PER_DEGREE + (after[0] if after else 0), MAX_DISTANCE_KM)
+        while True:
+            hits = self.within(location, radius_km, predicate)
+            if after is not None:
+                hits = [hit for hit in hits if (hit[1], hit[0]) > (after[0], after[1])]
+            if len(hits) >= count or radius_km >= MAX_DISTANCE_KM:
+                hits.sort(key=lambda hit: (hit[1], hit[0]))
+                return hits[:count]
+            radius_km = min(radius_km * 2, MAX_DISTANCE_KM)
@@ -0,0 +1,207 @@
+"""
+Delete upload files that no database row refers to.
+
+Files become orphans when a photo or blob row is deleted (blob_store.release
+leaves the files on disk), when a failed upload leaves renditions behind,
+and when QR codes are re-rendered or their attraction is gone.
+
+The referenced names are loaded once into a set, a few hundred rows per
+query with the read transaction ended after each, so writers are never
+held up. The upload folder is then streamed with os.scandir and each file
+is looked up in the set. Files younger than the grace period are kept,
+since their rows may not be committed yet. Before anything is deleted the
+set is loaded again, so rows added during the scan protect their files
+too. Deletions happen in batches with a pause in between.
+
+Usage:
+    python sweep_uploads.py [--dry-run] [--grace-hours 24] [--batch-size 500] [--pause 0.05]
+"""
+import argparse
+import os
+import sys
+import time
+
+import database
+import qr_codes
+from models import db, Attraction, Blob, Photo, User
+
+# Referenced by templates rather than by a row
+PROTECTED = {'placeholder-image.jpg'}
+# Precompressed variants are kept as long as the file they belong to
+VARIANT_SUFFIXES = ('.gz', '.br')
+CHUNK_SIZE = 500
+
+
+def _rows(columns, key, chunk_size):
+    """Stream rows in key order, one short read transaction per chunk"""
+    last = None
+    while True:
+        query = db.select(*columns).order_by(key).limit(chunk_size)
+        if last is not None:
+            query = query.where(key > last)
+        rows = db.session.execute(query).all()
+        db.session.rollback()
+        if not rows:
+            return
+        yield from rows
+        last = rows[-1][0]
+
+
+def _rendition_files(renditions):
+    for entry in (renditions or {}).values():
+        for value in entry.values():
+            if isinstance(value, str):
+                yield value
+
+
+def upload_path(value):
+    """
+    Path relative to the upload folder of a stored file name or URL.
+
+    Accepts 'photo.jpg', 'uploads/photo.jpg', 'static/uploads/photo.jpg'
+    and '/static/uploads/photo.jpg' alike.
+    """
+    path = value.strip().lstrip('/')
+    for prefix in ('static/', 'uploads/'):
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+    return path
+
+
+def referenced_files(chunk_size=CHUNK_SIZE):
+    """
+    Paths, relative to the upload folder, of every file a row refers to.
+
+    Covers photos and blobs (original or raw file and every rendition),
+    users' profile photos and the current QR codes of existing attractions
+    in each format.
+
+    Returns:
+    - Set of paths using '/' as separator
+    """
+    referenced = set(PROTECTED)
+    for model in (Photo, Blob):
+        for _, filename, renditions in _rows((model.id, model.filename, model.renditions), model.id, chunk_size):
+            referenced.add(filename)
+            referenced.update(_rendition_files(renditions))
+
+    for _, profile_photo in _rows((User.id, User.profile_photo), User.id, chunk_size):
+        if profile_photo:
+            referenced.add(upload_path(profile_photo))
+
+    rows = _rows((Attraction.id, Attraction.name, Attraction.description), Attraction.id, chunk_size)
+    for attraction_id, name, description in rows:
+        payload = qr_codes.attraction_payload(name, description)
+        for fmt in qr_codes.FORMATS:
+            referenced.add(f'{qr_codes.CACHE_FOLDER}/{qr_codes.cache_filename(attraction_id, payload, fmt)}')
+    return referenced
+
+
+def scan(folder, prefix=''):
+    """
+    Stream the files under folder without listing it all first.
+
+    Yields:
+    - (path relative to folder with '/' separators, os.DirEntry) pairs
+    """
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan(entry.path, f'{prefix}{entry.name}/')
+            elif entry.is_file(follow_symlinks=False):
+                yield f'{prefix}{entry.name}', entry
+
+
+def is_referenced(path, referenced):
+    if path in referenced:
+        return True
+    stem, ext = os.path.splitext(path)
+    return ext in VARIANT_SUFFIXES and stem in referenced
+
+
+def find_orphans(upload_folder, referenced, grace_seconds, now=None):
+    """
+    Scan the upload folder for unreferenced files older than the grace period.
+
+    Returns:
+    - Tuple of (list of (path, size) orphans, dict of counts with 'files',
+      'referenced' and 'recent')
+    """
+    now = time.time() if now is None else now
+    orphans = []
+    counts = {'files': 0, 'referenced': 0, 'recent': 0}
+    for path, entry in scan(upload_folder):
+        counts['files'] += 1
+        if is_referenced(path, referenced):
+            counts['referenced'] += 1
+            continue
+        stat = entry.stat(follow_symlinks=False)
+        if now - stat.st_mtime < grace_seconds:
+            counts['recent'] += 1
+            continue
+        orphans.append((path, stat.st_size))
+    return orphans, counts
+
+
+def sweep(upload_folder, grace_seconds=24 * 60 * 60, dry_run=False, batch_size=500, pause=0.05, chunk_size=CHUNK_SIZE):
+    """
+    Find orphaned upload files and delete them.
+
+    Args:
+    - upload_folder: Folder photos, blobs and QR codes are stored in
+    - grace_seconds: Keep unreferenced files modified more recently than this
+    - dry_run: Only report what would be deleted
+    - batch_size: Files deleted between pauses
+    - pause: Seconds to sleep between batches
+    - chunk_size: Rows loaded per query
+
+    Returns:
+    - Dict of counts: 'files', 'referenced', 'recent', 'orphans',
+      'deleted' and 'bytes' (size of the orphans), plus the 'orphan_paths'
+    """
+    orphans, stats = find_orphans(upload_folder, referenced_files(chunk_size), grace_seconds)
+    if orphans and not dry_run:
+        # Rows committed while scanning still protect their files
+        referenced = referenced_files(chunk_size)
+        orphans = [(path, size) for path, size in orphans if not is_referenced(path, referenced)]
+
+    stats.update(orphans=len(orphans), deleted=0, bytes=sum(size for _, size in orphans),
+                 orphan_paths=[path for path, _ in orphans])
+    if dry_run:
+        return stats
+
+    for start in range(0, len(orphans), batch_size):
+        for path, _ in orphans[start:start + batch_size]:
+            try:
+                os.remove(os.path.join(upload_folder, *path.split('/')))
+                stats['deleted'] += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f'{path}: not deleted, {e!r}', file=sys.stderr)
+        if pause and start + batch_size < len(orphans):
+            time.sleep(pause)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dry-run', action='store_true', help='List orphans without deleting them')
+    parser.add_argument('--grace-hours', type=float, default=24)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--pause', type=float, default=0.05, help='Seconds between deletion batches')
+    args = parser.parse_args()
+
+    app = database.create_script_app()
+    with app.app_context():
+        stats = sweep(app.config['UPLOAD_FOLDER'], args.grace_hours * 60 * 60, args.dry_run,
+                      args.batch_size, args.pause)
+    if args.dry_run:
+        for path in stats['orphan_paths']:
+            print(path)
+    print(f"{stats['files']} file(s): {stats['referenced']} referenced, {stats['recent']} within the grace period, "
+          f"{stats['orphans']} orphaned ({stats['bytes'] / 1024 / 1024:.1f} MB), {stats['deleted']} deleted")
+
+
+if __name__ == '__main__':
+    main()